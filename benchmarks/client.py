@@ -0,0 +1,80 @@
+import json
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.stub_server import DEFAULT_FAULTS, start_stub_server
+from core.client import LLMUnavailable, CircuitBreaker, ResilientClient
+
+# Each scenario is a stub server fault profile and the client settings it is run with
+SCENARIOS = {
+    'healthy': ({}, {}),
+    'slow_tail': ({'slow_rate': 0.05, 'slow_latency': 1.0}, {}),
+    'slow_tail_hedged': ({'slow_rate': 0.05, 'slow_latency': 1.0}, {'hedge_percentile': 0.9}),
+    'errors_no_retries': ({'error_rate': 0.2, 'rate_limit_rate': 0.05}, {'max_retries': 0, 'breaker': CircuitBreaker(failure_threshold=1000)}),
+    'errors_retried': ({'error_rate': 0.2, 'rate_limit_rate': 0.05}, {'backoff': 0.05, 'breaker': CircuitBreaker(failure_threshold=1000)}),
+    'hanging': ({'hang_rate': 0.05, 'hang': 5.0}, {'deadline': 1.5, 'backoff': 0.05}),
+    'hanging_attempt_timeout': ({'hang_rate': 0.05, 'hang': 5.0}, {'deadline': 1.5, 'attempt_timeout': 0.5, 'backoff': 0.05}),
+    'outage': ({'error_rate': 1.0}, {'backoff': 0.05, 'breaker': CircuitBreaker(failure_threshold=5, reset_timeout=60.0)})
+}
+
+
+def call(client):
+    start = time.perf_counter()
+
+    try:
+        client.create(model='stub', messages=[{'role': 'system', 'content': 'What is a better response if a patient has Common Cold?'}])
+        succeeded = True
+    except LLMUnavailable:
+        succeeded = False
+
+    return succeeded, (time.perf_counter() - start) * 1000
+
+
+def run_scenario(faults, settings, requests, concurrency):
+    server = start_stub_server(**{**DEFAULT_FAULTS, **faults})
+    # Twice as many slots as callers, so hedges and retries have headroom
+    client = ResilientClient(api_key='stub', base_url=server.base_url, max_concurrency=concurrency * 2, **settings)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: call(client), range(requests)))
+
+    server.shutdown()
+
+    timings = sorted(timing for succeeded, timing in results)
+
+    return {
+        'requests': requests,
+        'success_rate': statistics.fmean(succeeded for succeeded, timing in results),
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[int(len(timings) * 0.95)],
+        'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        'upstream_requests': server.counts.get('requests', 0),
+        'breaker': client.breaker.state()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency and success rate of the resilient OpenAI client against the offline stub server.')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    report = {}
+
+    for name in args.scenarios:
+        faults, settings = SCENARIOS[name]
+        result = run_scenario(faults, settings, args.requests, args.concurrency)
+        report[name] = result
+
+        print(f'{name}: success={result["success_rate"]:.3f} p50={result["p50_ms"]:.1f}ms p95={result["p95_ms"]:.1f}ms p99={result["p99_ms"]:.1f}ms upstream={result["upstream_requests"]} breaker={result["breaker"]}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import sys
+import json
+import argparse
+
+
+def compare(baseline, current, threshold, metric='median_ms'):
+    regressions = []
+
+    for name, result in sorted(current['results'].items()):
+        if name not in baseline['results']:
+            print(f'{name}: new')
+            continue
+
+        before = baseline['results'][name][metric]
+        after = result[metric]
+        change = (after - before) / before if before > 0 else 0.0
+        flag = 'REGRESSION' if change > threshold else ''
+
+        print(f'{name}: {before:.3f}ms -> {after:.3f}ms ({change:+.1%}) {flag}')
+
+        if flag:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares two benchmark result files and fails on regressions.')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.15, help='Allowed slowdown as a fraction, e.g. 0.15 for 15%%')
+    parser.add_argument('--metric', default='median_ms')
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+
+    with open(args.current) as file:
+        current = json.load(file)
+
+    print(f"Comparing {baseline['meta'].get('commit')} -> {current['meta'].get('commit')}")
+    regressions = compare(baseline, current, args.threshold, args.metric)
+
+    if regressions:
+        print(f'{len(regressions)} regression(s) above {args.threshold:.0%}')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import logging
+import time
+import argparse
+import platform
+import resource
+import statistics
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from benchmarks.run import CONVERSATIONS, RESULTS_DIR, get_commit
+from benchmarks.stub_server import start_stub_server
+from core.workers import BACKENDS
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'SymptoScan.py')
+
+# share_globals patches Streamlit internals, they were only checked against the version pinned in benchmarks/requirements.txt
+STREAMLIT_VERSION = '1.65.0'
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def peak_rss():
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def check_streamlit():
+    import streamlit
+
+    if streamlit.__version__ != STREAMLIT_VERSION:
+        raise RuntimeError(f'The load test needs streamlit=={STREAMLIT_VERSION} (pip install -r benchmarks/requirements.txt), {streamlit.__version__} is installed')
+
+
+def share_globals(secrets):
+    import streamlit as st
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.pages_manager import PagesManager
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    check_streamlit()
+
+    # AppTest swaps a few process-wide globals around every run and resets them afterwards, which races between
+    # concurrent sessions, so they are pinned for the whole level instead: the secrets, the appTest option and the runtime
+    st.secrets = Secrets()
+    st.secrets._secrets = secrets
+    config.set_option('global.appTest', True)
+
+    # Reading a session's state from the harness thread is expected here
+    logging.getLogger('streamlit.runtime.scriptrunner_utils.script_run_context').setLevel(logging.ERROR)
+
+    last_runtime = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            last_runtime[:] = [cls._instance]
+
+        if not last_runtime:
+            raise RuntimeError("Runtime hasn't been created!")
+
+        return cls._instance or last_runtime[0]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or len(last_runtime) > 0)
+
+    # The reset of the pages directory flag lands on a subclass, a run that misses the flag renders its widgets under other ids and drops the message
+    app_test.PagesManager = type('PagesManager', (PagesManager,), {})
+
+    # Like the server, the page is compiled once and not on every run, parsing from several threads at once is not safe
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+
+def new_app(timeout):
+    from streamlit.testing.v1 import AppTest
+
+    return AppTest.from_file(APP_PATH, default_timeout=timeout).run()
+
+
+def run_session(index, conversations, think_time, timeout):
+    from core.conversation import NOT_ASKING
+    from core.metrics import metrics
+
+    app = new_app(timeout)
+    names = list(CONVERSATIONS)
+    turns = []
+    errors = 0
+
+    def send(message):
+        nonlocal errors
+
+        session_id = app.session_state.session.session_id
+        previous_turns = metrics.recent_turns(session_id)
+
+        start = time.perf_counter()
+        app.chat_input[0].set_value(message).run()
+        duration = (time.perf_counter() - start) * 1000
+
+        # The page records its own reruns and OpenAI calls on the turn, the same numbers the metrics endpoint exports
+        recent_turns = metrics.recent_turns(session_id)
+        recent_turn = recent_turns[-1] if recent_turns and (not previous_turns or recent_turns[-1] is not previous_turns[-1]) else None
+
+        # An exception, or a message the page never answered
+        if app.exception or recent_turn is None:
+            errors += 1
+
+        turns.append({
+            'duration_ms': duration,
+            'reruns': recent_turn.reruns if recent_turn else 0,
+            'turn': recent_turn
+        })
+
+        time.sleep(think_time)
+
+    try:
+        # Sessions start on different scripts, so every state of the page is busy at once
+        for i in range(conversations):
+            for message in CONVERSATIONS[names[(index + i) % len(names)]]:
+                send(message)
+
+            # Leftover questions are answered with "no", like the micro-benchmarks do
+            for _ in range(100):
+                if app.session_state.session.state == NOT_ASKING:
+                    break
+
+                send('no')
+    except (IndexError, KeyError, RuntimeError):
+        # The page failed to render its chat input, the session cannot go on
+        errors += 1
+
+    return turns, errors, app
+
+
+def run_level(sessions, conversations, think_time, secrets, timeout, cache):
+    # Runs in a fresh process per level, so the peak RSS is not carried over from a smaller level
+    import core.llm
+    from core.cache import ResponseCache
+    from core.prefetch import prefetcher
+
+    # Never touches the on-disk cache, without --cache every recommendation reaches the stub
+    core.llm.response_cache = ResponseCache(path=None, max_memory_entries=256 if cache else 0)
+
+    share_globals(secrets)
+
+    # A first session builds the shared engine, the worker pools and the OpenAI client, so only the sessions themselves are measured
+    run_session(0, len(CONVERSATIONS), 0, timeout)
+    baseline = peak_rss()
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(lambda index: run_session(index, conversations, think_time, timeout), range(sessions)))
+
+    elapsed = time.perf_counter() - start
+    peak = peak_rss()
+
+    # Prefetched recommendations still in flight are counted on the turns that started them once they land
+    while prefetcher.pending() > 0:
+        time.sleep(0.01)
+
+    turns = [turn for session_turns, _, _ in results for turn in session_turns]
+
+    for turn in turns:
+        recent_turn = turn.pop('turn')
+        turn['openai_calls'] = recent_turn.openai_calls if recent_turn else 0
+
+    durations = sorted(turn['duration_ms'] for turn in turns)
+
+    return {
+        'sessions': sessions,
+        'turns': len(turns),
+        'errors': sum(errors for _, errors, _ in results),
+        'elapsed_s': elapsed,
+        'turns_per_second': len(turns) / elapsed,
+        'median_ms': statistics.median(durations) if durations else 0.0,
+        'p95_ms': percentile(durations, 0.95),
+        'p99_ms': percentile(durations, 0.99),
+        'reruns_per_turn': statistics.fmean(turn['reruns'] for turn in turns) if turns else 0.0,
+        'openai_calls_per_turn': statistics.fmean(turn['openai_calls'] for turn in turns) if turns else 0.0,
+        'peak_rss_mb': peak / 2 ** 20,
+        'rss_per_session_mb': (peak - baseline) / 2 ** 20 / sessions
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drives concurrent scripted sessions through SymptoScan.py with AppTest, OpenAI is replaced by the stub server.')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--conversations', type=int, default=len(CONVERSATIONS), help='scripted conversations per session, by default every script once')
+    parser.add_argument('--think-time', type=float, default=0.0, help='seconds a user waits before the next message')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds the stub OpenAI API takes per call')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--matching-backend', default='thread', choices=BACKENDS)
+    parser.add_argument('--matching-workers', type=int, default=2)
+    parser.add_argument('--cache', action='store_true', help='keep an in-memory response cache, as the app does')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds a single turn may take')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    try:
+        check_streamlit()
+    except RuntimeError as error:
+        parser.error(str(error))
+
+    server = start_stub_server(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    secrets = {
+        'openai_secret_key': 'stub',
+        'openai_base_url': server.base_url,
+        # Without the cosmetic typing effect, the turn latency is the page's own
+        'typing_duration': 0,
+        'matching_backend': args.matching_backend,
+        'matching_workers': args.matching_workers
+    }
+
+    commit = get_commit()
+    levels = {}
+    results = {}
+
+    for sessions in args.sessions:
+        requests_before = server.counts.get('requests', 0)
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            level = pool.submit(run_level, sessions, args.conversations, args.think_time, secrets, args.timeout, args.cache).result()
+
+        level['openai_requests'] = server.counts.get('requests', 0) - requests_before
+        levels[sessions] = level
+
+        # Same shape as the micro-benchmarks, so benchmarks.compare can diff the turn latency of two releases
+        results[f'turn@{sessions}'] = {'runs': level['turns'], 'median_ms': level['median_ms'], 'p95_ms': level['p95_ms'], 'p99_ms': level['p99_ms']}
+
+        print(f'{sessions} sessions: {level["turns_per_second"]:.2f} turns/s p50={level["median_ms"]:.0f}ms p95={level["p95_ms"]:.0f}ms p99={level["p99_ms"]:.0f}ms reruns/turn={level["reruns_per_turn"]:.2f} errors={level["errors"]} peak RSS={level["peak_rss_mb"]:.0f}MB ({level["rss_per_session_mb"]:.1f}MB per session)')
+
+    report = {
+        'meta': {
+            'commit': commit,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'sessions': args.sessions,
+            'conversations': args.conversations,
+            'think_time': args.think_time,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'error_rate': args.error_rate,
+            'matching_backend': args.matching_backend,
+            'matching_workers': args.matching_workers,
+            'cache': args.cache
+        },
+        'levels': levels,
+        'results': results
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f'load-{commit or "local"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(f'Saved to {output}')
+
+
+if __name__ == "__main__":
+    main()
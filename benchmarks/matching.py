@@ -0,0 +1,102 @@
+import json
+import time
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import benchmarks.stub_llm
+from benchmarks.run import QUERIES
+from core.conversation import ConversationEngine
+from core.workers import BACKENDS, Overloaded, get_matching_pool
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def session(engine, queries):
+    timings = []
+    rejected = 0
+
+    for query in queries:
+        start = time.perf_counter()
+
+        try:
+            engine.get_most_similar_response(engine.get_diseases_df(), 'Disease', query)
+            timings.append((time.perf_counter() - start) * 1000)
+        except Overloaded:
+            rejected += 1
+
+    return timings, rejected
+
+
+def measure_lag(stop, lags, interval=0.001):
+    # Stands in for the rendering of other sessions, any time the GIL is held longer than the interval shows up as lag
+    while not stop.is_set():
+        start = time.perf_counter()
+        time.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+
+
+def run_backend(backend, sessions, queries_per_session, workers):
+    engine = ConversationEngine(llm=benchmarks.stub_llm, matching=get_matching_pool(backend, workers))
+    engine.warm_up()
+
+    # Warm every worker before measuring
+    session(engine, QUERIES * workers)
+
+    lags = []
+    stop = threading.Event()
+    ticker = threading.Thread(target=measure_lag, args=(stop, lags), daemon=True)
+    ticker.start()
+
+    queries = [QUERIES[i % len(QUERIES)] for i in range(queries_per_session)]
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        results = list(pool.map(lambda _: session(engine, queries), range(sessions)))
+
+    elapsed = time.perf_counter() - start
+    stop.set()
+    ticker.join()
+
+    timings = sorted(timing for session_timings, _ in results for timing in session_timings)
+    lags.sort()
+
+    return {
+        'sessions': sessions,
+        'queries': sessions * queries_per_session,
+        'throughput_qps': len(timings) / elapsed,
+        'p50_ms': statistics.median(timings) if timings else 0.0,
+        'p99_ms': percentile(timings, 0.99),
+        'rejected': sum(rejected for _, rejected in results),
+        'lag_p99_ms': percentile(lags, 0.99),
+        'lag_max_ms': lags[-1] if lags else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput and latency of query matching inline against the worker pool backends.')
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--queries', type=int, default=50, help='queries per session')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    report = {}
+
+    for backend in args.backends:
+        for sessions in args.sessions:
+            result = run_backend(backend, sessions, args.queries, args.workers)
+            report[f'{backend}_{sessions}'] = result
+
+            print(f'{backend} x{sessions}: {result["throughput_qps"]:.0f} queries/s p50={result["p50_ms"]:.2f}ms p99={result["p99_ms"]:.2f}ms rejected={result["rejected"]} lag p99={result["lag_p99_ms"]:.2f}ms max={result["lag_max_ms"]:.2f}ms')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
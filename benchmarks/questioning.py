@@ -0,0 +1,118 @@
+import json
+import random
+import argparse
+import statistics
+from core.datasets import get_diseases_df
+from core.questioning import CONFIDENCE, MAX_QUESTIONS, MIN_CONFIRMED, Questioning, get_incidence_matrix
+
+
+def confusable(matrix, truth, count):
+    # The diseases sharing the most symptoms with the truth, the hardest ones to tell apart
+    overlap = (matrix.incidence & matrix.incidence[truth]).sum(axis=1)
+    overlap[truth] = -1
+
+    return [int(i) for i in overlap.argsort(kind='stable')[::-1][:count]]
+
+
+def patient(matrix, truth, noise, rng):
+    # Answers from the dataset, every answer flipped with the noise probability
+    def answer(symptom):
+        experiencing = bool(matrix.incidence[truth, matrix.positions[symptom.lower()]])
+        return experiencing != (rng.random() < noise)
+
+    return answer
+
+
+def legacy_flow(df, candidates, answer):
+    # The previous flow: every Specific Symptom of one candidate after another, 60% "yes" confirms it
+    questions = 0
+
+    for candidate in candidates:
+        symptoms = [symptom.strip() for symptom in df.iloc[candidate]['Specific Symptoms'].split(',')]
+        experiencing = 0
+
+        for symptom in symptoms:
+            questions += 1
+            experiencing += answer(symptom)
+
+        if experiencing / len(symptoms) >= 0.6:
+            return candidate, questions
+
+    return None, questions
+
+
+def adaptive_flow(matrix, candidates, answer, confidence, max_questions, min_confirmed):
+    questioning = Questioning(matrix, candidates, min_confirmed=min_confirmed)
+
+    while (symptom := questioning.next_question(confidence, max_questions)) is not None:
+        questioning.answer(symptom, answer(symptom))
+
+    return questioning.diagnosis(confidence), len(questioning.answers)
+
+
+def simulate(df, pool_size, noise, confidence, max_questions, min_confirmed, seed=0):
+    matrix = get_incidence_matrix(df)
+    rng = random.Random(seed)
+    results = {'legacy': [], 'adaptive': []}
+    absent = {'legacy': [], 'adaptive': []}
+
+    # Every disease is the truth once at every position of a pool of its most confusable diseases
+    for truth in range(len(df)):
+        others = confusable(matrix, truth, pool_size - 1)
+
+        for position in range(pool_size):
+            candidates = others[:position] + [truth] + others[position:]
+
+            diagnosis, questions = legacy_flow(df, candidates, patient(matrix, truth, noise, rng))
+            results['legacy'].append((diagnosis == truth, diagnosis is None, questions))
+
+            diagnosis, questions = adaptive_flow(matrix, candidates, patient(matrix, truth, noise, rng), confidence, max_questions, min_confirmed)
+            results['adaptive'].append((diagnosis == truth, diagnosis is None, questions))
+
+        # The patient has none of the candidates, e.g. the retriever missed, any diagnosis is a wrong one
+        candidates = confusable(matrix, truth, pool_size)
+
+        absent['legacy'].append(legacy_flow(df, candidates, patient(matrix, truth, noise, rng))[0] is not None)
+        absent['adaptive'].append(adaptive_flow(matrix, candidates, patient(matrix, truth, noise, rng), confidence, max_questions, min_confirmed)[0] is not None)
+
+    return {
+        flow: {
+            'diagnoses': len(outcomes),
+            'accuracy': statistics.fmean(correct for correct, failed, questions in outcomes),
+            'scan_failed': statistics.fmean(failed for correct, failed, questions in outcomes),
+            'mean_questions': statistics.fmean(questions for correct, failed, questions in outcomes),
+            'max_questions': max(questions for correct, failed, questions in outcomes),
+            'false_diagnosis': statistics.fmean(absent[flow])
+        }
+        for flow, outcomes in results.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Questions per diagnosis of the adaptive symptom questioning against the previous flow, simulated over diseases.csv.')
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 2, 3, 5])
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.0, 0.1])
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE)
+    parser.add_argument('--max-questions', type=int, default=MAX_QUESTIONS)
+    parser.add_argument('--min-confirmed', type=float, default=MIN_CONFIRMED, help='share of the diagnosed disease\'s symptoms answered "yes", 0 to rely on the posterior alone')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    df = get_diseases_df()
+    report = {}
+
+    for pool_size in args.pool_sizes:
+        for noise in args.noise:
+            result = simulate(df, pool_size, noise, args.confidence, args.max_questions, args.min_confirmed)
+            report[f'pool_{pool_size}_noise_{noise:g}'] = result
+
+            for flow, summary in result.items():
+                print(f'{pool_size} candidates, noise {noise:g}, {flow:>8}: {summary["mean_questions"]:.2f} questions (max {summary["max_questions"]}), accuracy {summary["accuracy"]:.3f}, scan failed {summary["scan_failed"]:.3f}, false diagnosis {summary["false_diagnosis"]:.3f}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
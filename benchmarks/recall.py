@@ -0,0 +1,87 @@
+import json
+import time
+import random
+import argparse
+import statistics
+import tracemalloc
+from benchmarks.synthetic import synthetic_phrases
+from core.similarity import ApproximateSimilarityIndex, ExactSimilarityIndex
+
+
+def perturb(text, rng):
+    # A user's phrasing of a catalog entry: one typo and a different case
+    characters = list(text.lower())
+    position = rng.randrange(len(characters))
+    characters[position] = rng.choice('abcdefghijklmnopqrstuvwxyz')
+
+    return ''.join(characters)
+
+
+def build(index_class, df):
+    # Retained size of the fitted index, the catalog itself is allocated beforehand
+    tracemalloc.start()
+    index = index_class(df, 'Symptom')
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return index, memory / 2 ** 20
+
+
+def measure(index, queries, top_k):
+    timings = []
+    results = []
+
+    for query in queries:
+        start = time.perf_counter()
+        _, scores = index.search(query, top_k)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append(scores)
+
+    timings.sort()
+
+    return results, statistics.median(timings), timings[int(len(timings) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of the approximate similarity index against the exact one.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    report = {}
+
+    for size in args.sizes:
+        df = synthetic_phrases(size)
+        queries = [perturb(text, rng) for text in rng.sample(df['Symptom'].tolist(), min(args.queries, size))]
+
+        exact, exact_memory = build(ExactSimilarityIndex, df)
+        approximate, approximate_memory = build(ApproximateSimilarityIndex, df)
+
+        exact_results, exact_median, exact_p95 = measure(exact, queries, args.top_k)
+        approximate_results, approximate_median, approximate_p95 = measure(approximate, queries, args.top_k)
+
+        # Tie-aware: an approximate hit counts when it scores at least as high as the exact k-th result
+        recall = statistics.fmean(min(1.0, (found >= expected[-1] - 1e-9).sum() / len(expected)) for found, expected in zip(approximate_results, exact_results))
+
+        report[size] = {
+            'recall_at_k': recall,
+            'exact_median_ms': exact_median,
+            'exact_p95_ms': exact_p95,
+            'approximate_median_ms': approximate_median,
+            'approximate_p95_ms': approximate_p95,
+            'exact_memory_mb': exact_memory,
+            'approximate_memory_mb': approximate_memory
+        }
+
+        print(f'{size} rows: recall@{args.top_k}={recall:.3f} exact={exact_median:.3f}ms (p95 {exact_p95:.3f}ms) approximate={approximate_median:.3f}ms (p95 {approximate_p95:.3f}ms) memory exact={exact_memory:.0f}MB approximate={approximate_memory:.0f}MB')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
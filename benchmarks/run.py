@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import benchmarks.stub_llm
+from benchmarks.synthetic import SIZES, scale_diseases, scale_symptoms
+from core.conversation import NOT_ASKING, ConversationEngine, render_text
+from core.nlp import clean_query, preprocess_query
+from core.retrieval import get_symptom_retriever
+from core.similarity import get_similarity_index
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+QUERIES = [
+    "I am experiencing symptoms such as runny nose, coughing, sore throat.",
+    "I have a fever, body aches and I feel tired all the time!!",
+    "Nausea, vomiting and stomach cramps since yesterday",
+    "My eyes are itchy and watery and I keep sneezing",
+    "Common Cold"
+]
+
+# Every state of the engine is reached by at least one script, leftover questions are answered with "no"
+CONVERSATIONS = {
+    'help': ['help'],
+    'summarize_short': ['summarize'],
+    'no_match': ['qwerty zxcvb'],
+    'diagnose_yes': ['Common Cold', 'yes'],
+    'diagnose_stop': [QUERIES[0], 'stop'],
+    'diagnose_summarize': [QUERIES[0], 'summarize'],
+    'questioning_yes': [QUERIES[0], 'no', 'yes', 'yes', 'yes', 'yes'],
+    'questioning_stop': [QUERIES[0], 'no', 'stop'],
+    'questioning_scan_failed': [QUERIES[0], 'no']
+}
+
+
+def measure(fn, repeat, min_time=0.2):
+    fn()
+
+    timings = []
+    started = time.perf_counter()
+
+    while len(timings) < repeat or (time.perf_counter() - started < min_time and len(timings) < repeat * 10):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+
+    return {
+        'runs': len(timings),
+        'mean_ms': statistics.fmean(timings),
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        'min_ms': timings[0]
+    }
+
+
+def run_conversation(engine, messages):
+    session = engine.new_session()
+
+    for message in messages:
+        for reply in engine.step(session, message):
+            render_text(reply)
+
+    for _ in range(100):
+        if session.state == NOT_ASKING:
+            break
+
+        for reply in engine.step(session, 'no'):
+            render_text(reply)
+
+
+def run_size(size, repeat, results):
+    diseases_df = scale_diseases(size)
+    symptoms_df = scale_symptoms(max(size, 24))
+
+    def record(name, fn, runs=repeat):
+        results[f'{name}@{size}'] = measure(fn, runs)
+        print(f"{name}@{size}: median={results[f'{name}@{size}']['median_ms']:.3f}ms p95={results[f'{name}@{size}']['p95_ms']:.3f}ms")
+
+    # Building the indexes happens once per process, it is timed separately from the per-query paths
+    start = time.perf_counter()
+    disease_index = get_similarity_index(diseases_df, 'Disease')
+    symptom_index = get_similarity_index(symptoms_df, 'Symptom')
+    retriever = get_symptom_retriever(diseases_df)
+    build_ms = (time.perf_counter() - start) * 1000
+    results[f'build_indexes@{size}'] = {'runs': 1, 'mean_ms': build_ms, 'median_ms': build_ms, 'p95_ms': build_ms, 'min_ms': build_ms}
+    print(f'build_indexes@{size}: {build_ms:.1f}ms')
+
+    filtered_queries = [preprocess_query(query) for query in QUERIES]
+
+    record('clean_query', lambda: [clean_query(query) for query in QUERIES])
+    record('preprocess_query', lambda: [preprocess_query(query) for query in QUERIES])
+    record('match_disease_name', lambda: [disease_index.query(query) for query in filtered_queries])
+    record('match_disease_symptoms', lambda: [retriever.query(query, top_k=3) for query in QUERIES])
+    record('lookup_symptom_description', lambda: [symptom_index.query(symptom) for symptom in ['Runny nose', 'Sore throat', 'Fever', 'Wheezing']])
+
+    engine = ConversationEngine(diseases_df, symptoms_df, llm=benchmarks.stub_llm, prefetch=False)
+
+    for name, messages in CONVERSATIONS.items():
+        record(f'conversation_{name}', lambda: run_conversation(engine, messages), runs=max(3, repeat // 10))
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the NLP and matching hot paths, OpenAI is stubbed out.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    commit = get_commit()
+    results = {}
+
+    for size in args.sizes:
+        run_size(size, args.repeat, results)
+
+    report = {
+        'meta': {
+            'commit': commit,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit or "local"}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(f'Saved to {output}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# Offline stand-in for core.llm, every call answers instantly with canned text
+
+
+def _chunks(text):
+    for i in range(0, len(text), 16):
+        yield text[i:i + 16]
+
+
+def get_disease_response(disease_name, stream=False):
+    result = f'Rest, drink plenty of fluids and consult a doctor if {disease_name} persists.'
+
+    return _chunks(result) if stream else result
+
+
+def update_chat_summary(summary, messages):
+    return f'{summary} The chat went on for {len(messages)} more messages.'.strip()
+
+
+def get_most_similar_diseases(prompt):
+    return []
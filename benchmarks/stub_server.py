@@ -0,0 +1,170 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Every fault is drawn per request, the server's faults can be changed while it runs
+DEFAULT_FAULTS = {
+    'latency': 0.05,
+    'jitter': 0.02,
+    'slow_rate': 0.0,
+    'slow_latency': 2.0,
+    'error_rate': 0.0,
+    'rate_limit_rate': 0.0,
+    'hang_rate': 0.0,
+    'hang': 60.0
+}
+
+STUB_RESPONSE = 'Rest, drink plenty of fluids and consult a doctor if the symptoms persist or get worse.'
+
+
+def _completion(body, content, tokens):
+    return {
+        'id': f'chatcmpl-stub{random.getrandbits(32):08x}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': tokens, 'completion_tokens': len(content) // 4, 'total_tokens': tokens + len(content) // 4}
+    }
+
+
+def _chunk(body, delta, finish_reason=None, usage=None):
+    return {
+        'id': 'chatcmpl-stub',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [] if usage else [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+        'usage': usage
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+        if not self.path.endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+            return
+
+        faults = self.server.faults
+        self.server.count('requests')
+
+        draw = random.random()
+        if draw < faults['error_rate']:
+            self.server.count('errors')
+            self.send_json(500, {'error': {'message': 'Injected server error', 'type': 'server_error'}})
+            return
+
+        if draw < faults['error_rate'] + faults['rate_limit_rate']:
+            self.server.count('rate_limited')
+            self.send_json(429, {'error': {'message': 'Injected rate limit', 'type': 'rate_limit_error'}})
+            return
+
+        if draw < faults['error_rate'] + faults['rate_limit_rate'] + faults['hang_rate']:
+            self.server.count('hung')
+            time.sleep(faults['hang'])
+
+        delay = faults['latency'] + random.uniform(0, faults['jitter'])
+        if random.random() < faults['slow_rate']:
+            self.server.count('slow')
+            delay += faults['slow_latency']
+
+        time.sleep(delay)
+
+        prompt_tokens = sum(len(str(message.get('content', ''))) for message in body.get('messages', [])) // 4
+
+        if body.get('stream'):
+            self.send_stream(body, prompt_tokens)
+        else:
+            self.send_json(200, _completion(body, STUB_RESPONSE, prompt_tokens))
+
+    def send_json(self, status, payload):
+        response = json.dumps(payload).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def send_stream(self, body, prompt_tokens):
+        # Server-sent events until the connection is closed, like the OpenAI streaming API
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        words = STUB_RESPONSE.split(' ')
+        events = [_chunk(body, {'role': 'assistant', 'content': ''})]
+        events += [_chunk(body, {'content': word if i == 0 else f' {word}'}) for i, word in enumerate(words)]
+        events.append(_chunk(body, {}, 'stop'))
+
+        if body.get('stream_options', {}).get('include_usage'):
+            events.append(_chunk(body, {}, usage={'prompt_tokens': prompt_tokens, 'completion_tokens': len(words), 'total_tokens': prompt_tokens + len(words)}))
+
+        for event in events:
+            self.wfile.write(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, **faults):
+        super().__init__(address, StubHandler)
+
+        self.faults = {**DEFAULT_FAULTS, **faults}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up on an injected hang close the connection, that is expected here
+        pass
+
+    @property
+    def base_url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/v1'
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def start_stub_server(port=0, host='127.0.0.1', **faults):
+    # Port 0 picks a free one, the server runs on a daemon thread until the process ends
+    server = StubServer((host, port), **faults)
+    threading.Thread(target=server.serve_forever, name='stub-openai', daemon=True).start()
+
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline OpenAI-compatible chat completions server with injectable latency and errors.')
+    parser.add_argument('--port', type=int, default=8788)
+
+    for name, value in DEFAULT_FAULTS.items():
+        parser.add_argument(f'--{name.replace("_", "-")}', type=float, default=value)
+
+    args = parser.parse_args()
+    server = StubServer(('127.0.0.1', args.port), **{name: getattr(args, name) for name in DEFAULT_FAULTS})
+
+    print(f'Serving a stub OpenAI API on {server.base_url}, set openai_base_url (or OPENAI_BASE_URL) to it')
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import random
+import regex as re
+import pandas as pd
+from core.datasets import get_diseases_df, get_symptoms_df
+
+SIZES = [10, 1000, 10000, 100000]
+
+
+def scale_diseases(n, seed=0):
+    # Clones the bundled rows, every clone gets its own name and a few unique symptoms so the vocabulary grows
+    rng = random.Random(seed)
+    base = get_diseases_df()
+    rows = []
+
+    for i in range(n):
+        row = base.iloc[i % len(base)].copy()
+
+        if i >= len(base):
+            generation = i // len(base)
+            markers = [f'marker{rng.randrange(n)}' for _ in range(2)]
+
+            row['Disease'] = f"{row['Disease']} Variant {generation}"
+            row['General Symptoms'] = ', '.join(row['General Symptoms'].split(', ') + markers)
+            row['Specific Symptoms'] = ', '.join(row['Specific Symptoms'].split(', ') + markers[:1])
+
+        rows.append(row)
+
+    return pd.DataFrame(rows).reset_index(drop=True)
+
+
+def scale_symptoms(n, seed=0):
+    rng = random.Random(seed)
+    base = get_symptoms_df()
+    rows = []
+
+    for i in range(n):
+        row = base.iloc[i % len(base)].copy()
+
+        if i >= len(base):
+            row['Symptom'] = f"{row['Symptom']} marker{rng.randrange(n)}"
+
+        rows.append(row)
+
+    return pd.DataFrame(rows).reset_index(drop=True)
+
+
+def synthetic_phrases(n, seed=0):
+    # Distinct symptom-like phrases built from the words of the bundled datasets
+    rng = random.Random(seed)
+    words = sorted(set(re.findall(r'[a-z]+', ' '.join(get_diseases_df().astype(str).values.ravel().tolist() + get_symptoms_df().astype(str).values.ravel().tolist()).lower())))
+    phrases = set()
+
+    while len(phrases) < n:
+        phrases.add(' '.join(rng.sample(words, rng.randint(2, 4))).capitalize())
+
+    return pd.DataFrame({'Symptom': sorted(phrases), 'Description': ''})
@@ -0,0 +1,121 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import regex as re
+from collections import OrderedDict
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+
+
+def normalize_prompt(prompt):
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def make_key(model, prompt, base_url):
+    # Responses of a stub server or a proxy are kept apart from the ones of the real API
+    return hashlib.sha256(f'{base_url.rstrip("/")}\n{model}\n{normalize_prompt(prompt)}'.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=os.path.join(CACHE_DIR, 'responses.sqlite3'), max_memory_entries=256, max_disk_entries=10000, ttl=7 * 24 * 60 * 60):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._connection = None
+
+        if path is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at REAL, accessed_at REAL)')
+            self._connection.commit()
+
+    def _is_expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _remember(self, key, response, created_at):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, model, prompt, base_url):
+        key = make_key(model, prompt, base_url)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+
+            if entry is not None and not self._is_expired(entry[1], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            self._memory.pop(key, None)
+
+            if self._connection is not None:
+                row = self._connection.execute('SELECT response, created_at FROM responses WHERE key = ?', (key,)).fetchone()
+
+                if row is not None and not self._is_expired(row[1], now):
+                    self._connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+                    self._connection.commit()
+                    self._remember(key, row[0], row[1])
+
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+                if row is not None:
+                    self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                    self._connection.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, model, prompt, response, base_url):
+        key = make_key(model, prompt, base_url)
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, response, now)
+
+            if self._connection is not None:
+                self._connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (key, model, response, now, now))
+
+                # Evict expired entries, then the least recently used ones above the size limit
+                if self.ttl is not None:
+                    self._connection.execute('DELETE FROM responses WHERE created_at < ?', (now - self.ttl,))
+
+                self._connection.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)', (self.max_disk_entries,))
+                self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+            if self._connection is not None:
+                self._connection.execute('DELETE FROM responses')
+                self._connection.commit()
+
+    def stats(self):
+        with self._lock:
+            disk_entries = self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0] if self._connection is not None else 0
+
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'disk_entries': disk_entries
+            }
@@ -0,0 +1,49 @@
+import math
+import numpy as np
+from core.nlp import preprocess_query
+from core.retrieval import get_symptom_retriever
+from core.similarity import get_similarity_index
+
+PAGE_SIZES = [10, 25, 50, 100]
+
+# Ranked searches stop here, a page never needs more than the first matches of a huge catalog
+MAX_SEARCH_RESULTS = 1000
+
+
+def _merge(*positions):
+    # Keeps the first occurrence of every row, earlier lists rank higher
+    merged = np.concatenate(positions)
+    _, first = np.unique(merged, return_index=True)
+
+    return merged[np.sort(first)]
+
+
+def search_diseases(df, query):
+    # Positions of the matching rows: disease names containing the query, then the chatbot's symptom retriever ranking
+    if query.strip() == '':
+        return np.arange(len(df))
+
+    by_name = np.flatnonzero(df['Disease'].str.contains(query.strip(), case=False, regex=False).to_numpy())
+    by_symptoms, _ = get_symptom_retriever(df).search(query, top_k=MAX_SEARCH_RESULTS)
+
+    return _merge(by_name, by_symptoms)
+
+
+def search_symptoms(df, query):
+    # Symptom names containing the query, then the same TF-IDF lookup the chatbot uses for symptom descriptions
+    if query.strip() == '':
+        return np.arange(len(df))
+
+    by_name = np.flatnonzero(df['Symptom'].str.contains(query.strip(), case=False, regex=False).to_numpy())
+    by_similarity, scores = get_similarity_index(df, 'Symptom').search(preprocess_query(query), top_k=min(len(df), MAX_SEARCH_RESULTS))
+
+    return _merge(by_name, by_similarity[scores > 0])
+
+
+def get_page(df, positions, page, page_size):
+    # Only the rows of one page are sliced out and sent to the browser
+    page_count = max(1, math.ceil(len(positions) / page_size))
+    page = min(max(page, 1), page_count)
+    start = (page - 1) * page_size
+
+    return df.iloc[positions[start:start + page_size]], start, page_count
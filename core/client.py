@@ -0,0 +1,257 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import openai
+from core.metrics import metrics
+
+# Failures worth another attempt, anything else (e.g. a bad request) would fail the same way again
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+
+DEADLINE = 20.0
+MAX_RETRIES = 2
+MAX_CONCURRENCY = 8
+
+
+class LLMUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+
+            return 'open' if time.monotonic() - self.opened_at < self.reset_timeout else 'half_open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial:
+                return False
+
+            # Half-open, a single trial call decides whether the breaker closes again
+            self.trial = True
+
+            return True
+
+    def release(self):
+        with self._lock:
+            self.trial = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trial = False
+                metrics.increment('symptoscan_openai_circuit_opened_total')
+
+
+class ResilientClient:
+    def __init__(self, deadline=DEADLINE, attempt_timeout=None, max_retries=MAX_RETRIES, backoff=0.5, max_backoff=4.0, max_concurrency=MAX_CONCURRENCY, hedge_percentile=None, hedge_min_samples=20, breaker=None, api_key=None, base_url=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._latencies = deque(maxlen=200)
+        self._latencies_lock = threading.Lock()
+        self._client = None
+        self._hedge_pool = None
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        # One client per process keeps its HTTP connections alive, built lazily so the page can set the API key first
+        with self._lock:
+            if self._client is None:
+                self._client = openai.OpenAI(api_key=self.api_key or openai.api_key, base_url=self.base_url or openai.base_url, timeout=self.deadline, max_retries=0)
+
+            return self._client
+
+    def get_base_url(self):
+        # The same fallbacks the OpenAI client uses, without building it
+        return str(self.base_url or openai.base_url or os.environ.get('OPENAI_BASE_URL') or DEFAULT_BASE_URL)
+
+    def get_hedge_pool(self):
+        with self._lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=self.max_concurrency * 2, thread_name_prefix='openai')
+
+            return self._hedge_pool
+
+    def hedge_delay(self):
+        # The chosen latency percentile of the recent calls, hedging waits until there are enough of them
+        if self.hedge_percentile is None:
+            return None
+
+        with self._latencies_lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+
+            latencies = sorted(self._latencies)
+
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile))]
+
+    def create(self, deadline=None, **kwargs):
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+
+        return self._with_retries(deadline_at, lambda: self._hedged(deadline_at, kwargs))
+
+    def stream(self, deadline=None, **kwargs):
+        # Retried until the first chunk arrives, the slot is held until the stream is closed
+        deadline_at = time.monotonic() + (deadline or self.deadline)
+
+        def attempt():
+            self._acquire(deadline_at)
+
+            try:
+                stream = self.get_client().chat.completions.create(stream=True, timeout=self._attempt_timeout(deadline_at), **kwargs)
+                chunks = iter(stream)
+
+                return stream, chunks, next(chunks, None)
+            except BaseException:
+                self._slots.release()
+                raise
+
+        stream, chunks, first = self._with_retries(deadline_at, attempt)
+
+        try:
+            if first is not None:
+                yield first
+
+            yield from chunks
+        except RETRYABLE_ERRORS as error:
+            self.breaker.record_failure()
+            raise LLMUnavailable('The OpenAI stream broke off') from error
+        except openai.OpenAIError as error:
+            metrics.increment('symptoscan_openai_failures_total', (('reason', type(error).__name__),))
+            raise LLMUnavailable('The OpenAI stream broke off') from error
+        finally:
+            stream.close()
+            self._slots.release()
+
+    def _remaining(self, deadline_at):
+        remaining = deadline_at - time.monotonic()
+
+        if remaining <= 0:
+            metrics.increment('symptoscan_openai_failures_total', (('reason', 'deadline'),))
+            raise LLMUnavailable('The OpenAI call ran out of time')
+
+        return remaining
+
+    def _attempt_timeout(self, deadline_at):
+        # A stalled attempt gives up early enough for a retry to fit into the deadline
+        remaining = self._remaining(deadline_at)
+
+        return remaining if self.attempt_timeout is None else min(self.attempt_timeout, remaining)
+
+    def _acquire(self, deadline_at, blocking=True):
+        if not self._slots.acquire(blocking, self._remaining(deadline_at) if blocking else None):
+            metrics.increment('symptoscan_openai_failures_total', (('reason', 'overloaded'),))
+            raise LLMUnavailable('Too many OpenAI calls are in flight')
+
+    def _with_retries(self, deadline_at, attempt):
+        if not self.breaker.allow():
+            metrics.increment('symptoscan_openai_failures_total', (('reason', 'circuit_open'),))
+            raise LLMUnavailable('The OpenAI circuit breaker is open')
+
+        for retry in range(self.max_retries + 1):
+            try:
+                result = attempt()
+            except RETRYABLE_ERRORS as error:
+                last_error = error
+            except openai.OpenAIError as error:
+                # Rejected, e.g. a missing or bad key or an unknown model, another attempt fails the same way but the caller still falls back
+                self.breaker.release()
+                metrics.increment('symptoscan_openai_failures_total', (('reason', type(error).__name__),))
+                raise LLMUnavailable('OpenAI rejected the call') from error
+            except BaseException:
+                # Not an upstream failure, a half-open breaker lets the next call be the trial instead
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+            # Full jitter, concurrent sessions do not retry in lockstep
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retry))
+
+            if retry == self.max_retries or time.monotonic() + delay >= deadline_at:
+                break
+
+            metrics.increment('symptoscan_openai_retries_total')
+            time.sleep(delay)
+
+        self.breaker.record_failure()
+        metrics.increment('symptoscan_openai_failures_total', (('reason', type(last_error).__name__),))
+
+        raise LLMUnavailable('OpenAI did not answer in time') from last_error
+
+    def _request(self, deadline_at, kwargs, blocking=True):
+        self._acquire(deadline_at, blocking)
+
+        try:
+            start = time.monotonic()
+            completion = self.get_client().chat.completions.create(timeout=self._attempt_timeout(deadline_at), **kwargs)
+
+            with self._latencies_lock:
+                self._latencies.append(time.monotonic() - start)
+
+            return completion
+        finally:
+            self._slots.release()
+
+    def _hedged(self, deadline_at, kwargs):
+        delay = self.hedge_delay()
+
+        if delay is None:
+            return self._request(deadline_at, kwargs)
+
+        primary = self.get_hedge_pool().submit(self._request, deadline_at, kwargs)
+
+        if len(wait([primary], timeout=delay).done) > 0:
+            return primary.result()
+
+        # The primary is slower than the chosen percentile, race a second request without queueing for a slot
+        metrics.increment('symptoscan_openai_hedges_total')
+        pending = {primary, self.get_hedge_pool().submit(self._request, deadline_at, kwargs, False)}
+
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+
+        return primary.result()
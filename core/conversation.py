@@ -0,0 +1,480 @@
+import sys
+import json
+import uuid
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import core.llm
+from core.client import LLMUnavailable
+from core.datasets import get_diseases_df, get_symptoms_df
+from core.knowledge import get_knowledge_base, install_knowledge_base
+from core.memory import ConversationMemory
+from core.metrics import span, turn
+from core.nlp import preprocess_query
+from core.prefetch import prefetcher
+from core.questioning import Questioning, get_incidence_matrix
+from core.retrieval import get_symptom_retriever
+from core.similarity import get_similarity_index
+from core.workers import Overloaded
+
+NOT_ASKING = "NOT_ASKING"
+IS_ASKING = "IS_ASKING"
+ASKING_SYMPTOM = "ASKING_SYMPTOM"
+WAITING_SYMPTOM_ANSWER = "WAITING_SYMPTOM_ANSWER"
+WAITING_SYMPTOM_CALCULATION = "WAITING_SYMPTOM_CALCULATION"
+SCAN_FAILED = "SCAN_FAILED"
+
+HELP_MESSAGE = 'Good day! You can start or continue this chat by telling us what symptoms you are currently experiencing.\n\nIt would help us if you specify what symptoms: e.g. "I am experiencing symptoms such as runny nose, coughing, sore throat."'
+SHORT_THREAD_MESSAGE = "This thread is still short for the bot to summarize. Please converse more with SymptoScan."
+SUMMARY_UNAVAILABLE_MESSAGE = "The summary of this chat is unavailable right now. Please try again later."
+OVERLOADED_MESSAGE = "SymptoScan is busy at the moment, please send your message again in a few seconds."
+STOP_MESSAGE = 'You can continue this chat by telling us what symptoms you are currently experiencing.\n\nIt would help us if you specify what symptoms: e.g. "I am experiencing symptoms such as runny nose, coughing, sore throat."'
+NO_MATCH_MESSAGE = 'We have failed to scan your symptoms, please try again and we recommend listing out what symptoms you are experiencing.\n\n(e.g. I am experiencing symptoms such as runny nose, coughing, sore throat.)'
+# The rolling summary is refreshed in the background once this many messages are waiting to be folded in
+SUMMARY_BATCH = 4
+
+SCAN_FAILED_MESSAGE = 'We have failed to scan your symptoms, please try again and we recommend listing out what symptoms you are experiencing: e.g. "I am experiencing symptoms such as runny nose, coughing, sore throat."'
+
+
+class Session:
+    __slots__ = (
+        'session_id',
+        'state',
+        'memory',
+        'possible_diseases',
+        'questioning',
+        'current_symptom',
+        'experiencing_symptoms',
+        'prefetched_recommendation',
+        'prefetched_symptoms'
+    )
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.state = NOT_ASKING
+        self.memory = ConversationMemory()
+        self.possible_diseases = []
+        self.questioning = None
+        self.current_symptom = None
+        self.experiencing_symptoms = []
+        self.prefetched_recommendation = [None, None]
+        self.prefetched_symptoms = None
+
+
+def compose_message(*parts):
+    # Static parts are emitted at once, streamed parts as their chunks arrive
+    for part in parts:
+        if isinstance(part, str):
+            yield part
+        else:
+            yield from part
+
+
+def render_text(reply):
+    return reply if isinstance(reply, str) else ''.join(reply)
+
+
+class ConversationEngine:
+    def __init__(self, diseases_df=None, symptoms_df=None, llm=core.llm, llm_fallback=False, prefetch=True, matching=None, similarity_backend='exact'):
+        self.diseases_df = diseases_df
+        self.symptoms_df = symptoms_df
+        self.llm = llm
+        self.llm_fallback = llm_fallback
+        self.prefetch = prefetch
+        self.matching = matching
+        self.similarity_backend = similarity_backend
+
+    def get_diseases_df(self):
+        return self.diseases_df if self.diseases_df is not None else get_diseases_df()
+
+    def get_symptoms_df(self):
+        return self.symptoms_df if self.symptoms_df is not None else get_symptoms_df()
+
+    def warm_up(self):
+        # With the bundled datasets a compiled knowledge base is mapped instead of fitting the indexes
+        if self.diseases_df is None and self.symptoms_df is None:
+            install_knowledge_base()
+
+        get_similarity_index(self.get_diseases_df(), 'Disease', self.similarity_backend)
+        get_similarity_index(self.get_symptoms_df(), 'Symptom', self.similarity_backend)
+        get_symptom_retriever(self.get_diseases_df())
+        get_incidence_matrix(self.get_diseases_df())
+
+    def new_session(self, session_id=None):
+        return Session(session_id)
+
+    def _dataset_name(self, df):
+        # Only the bundled datasets can be matched on the worker pool, workers load them by name
+        if self.diseases_df is None and df is get_diseases_df():
+            return 'diseases'
+
+        if self.symptoms_df is None and df is get_symptoms_df():
+            return 'symptoms'
+
+        return None
+
+    def get_most_similar_response(self, df, column, query, top_k=1):
+        dataset = self._dataset_name(df)
+
+        if self.matching is not None and dataset is not None:
+            with span('matching'):
+                return self.matching.match(dataset, column, query, top_k)
+
+        # Clean the query and drop stop words, spaCy is only loaded on the first call
+        with span('spacy'):
+            filtered_query = preprocess_query(query)
+
+        # Score against the pre-fitted TF-IDF index
+        with span('tfidf'):
+            return get_similarity_index(df, column, self.similarity_backend).query(filtered_query, top_k)
+
+    def get_symptom_descriptions(self, symptoms):
+        symptoms_df = self.get_symptoms_df()
+        knowledge_base = get_knowledge_base() if self.symptoms_df is None else None
+        compiled = knowledge_base.symptom_descriptions() if knowledge_base is not None else {}
+        missing = [symptom for symptom in symptoms if symptom not in compiled]
+
+        # Submitted together, so the worker pool can batch them
+        if self.matching is not None and self._dataset_name(symptoms_df) is not None:
+            with span('matching'):
+                matched = dict(zip(missing, self.matching.match_many('symptoms', 'Symptom', missing)))
+        else:
+            matched = {symptom: self.get_most_similar_response(symptoms_df, 'Symptom', symptom) for symptom in missing}
+
+        return {symptom: compiled[symptom] if symptom in compiled else matched[symptom][0][0][1][1] for symptom in symptoms}
+
+    def step(self, session, prompt):
+        with turn(session.session_id, session.state):
+            return self._step(session, prompt)
+
+    def _step(self, session, prompt):
+        # Handles one user message and every transition that follows it without input
+        replies = []
+
+        self.update_summary(session)
+
+        # Asking for the summary is not part of the chat it summarizes
+        if not (prompt in ['summarize', 'Summarize'] and session.state in [NOT_ASKING, IS_ASKING]):
+            session.memory.add('user', prompt)
+
+        while prompt is not None or session.state in [ASKING_SYMPTOM, WAITING_SYMPTOM_CALCULATION, SCAN_FAILED]:
+            handler = getattr(self, f'_on_{session.state.lower()}')
+
+            # The state is left as it was, the user's next message picks it up again
+            try:
+                handler(session, prompt, replies)
+            except Overloaded:
+                self._reply(session, replies, OVERLOADED_MESSAGE)
+                break
+
+            # Only the first handler sees the message, the rest are automatic transitions
+            prompt = None
+
+            if session.state in [NOT_ASKING, IS_ASKING, WAITING_SYMPTOM_ANSWER]:
+                break
+
+        return replies
+
+    def _reply(self, session, replies, message):
+        if isinstance(message, str):
+            session.memory.add('bot', message)
+            replies.append(message)
+        else:
+            replies.append(self._record(session, message))
+
+    def _record(self, session, chunks):
+        # Streamed replies reach the memory once they are fully consumed
+        received = []
+
+        for chunk in chunks:
+            received.append(chunk)
+            yield chunk
+
+        session.memory.add('bot', ''.join(received))
+
+    def _reset(self, session):
+        self.cancel_prefetch(session)
+
+        session.state = NOT_ASKING
+        session.possible_diseases = []
+        session.questioning = None
+        session.current_symptom = None
+        session.experiencing_symptoms = []
+
+    def _summarize(self, session, replies):
+        # Like the request, the answer stays out of the memory, otherwise the next summary would summarize the summary
+        if session.memory.bot_messages >= 5:
+            try:
+                replies.append(self.get_summary(session))
+            except LLMUnavailable:
+                replies.append(SUMMARY_UNAVAILABLE_MESSAGE)
+        else:
+            replies.append(SHORT_THREAD_MESSAGE)
+
+    def update_summary(self, session, batch=SUMMARY_BATCH):
+        # Folds the finished turns into the rolling summary on the prefetch pool, keyed apart from the cancellable prefetches
+        memory = session.memory
+
+        if memory.is_updating() or len(memory.pending) < batch:
+            return
+
+        generation, summary, folded = memory.begin_background_update()
+        future = prefetcher.submit(f'{session.session_id}:memory', self.llm.update_chat_summary, summary, folded)
+
+        if future is None:
+            memory.end_background_update(generation, folded, None)
+        else:
+            future.add_done_callback(lambda done: memory.end_background_update(generation, folded, done))
+
+    def get_summary(self, session, batch=SUMMARY_BATCH):
+        memory = session.memory
+
+        # A running update that covers all but a short tail is the answer, waited on until it has landed in the summary
+        if memory.unfolded() < batch:
+            memory.wait_for_update()
+
+        # Otherwise everything pending is folded inline in one call, a running update that lands later is dropped
+        if memory.summary == '' or memory.unfolded() >= batch:
+            generation, summary, folded = memory.begin_update()
+            memory.finish_update(generation, folded, self.llm.update_chat_summary(summary, folded))
+
+        return memory.summary
+
+    def _propose(self, session, candidates, replies):
+        row_index, row = candidates[0]
+
+        self.prefetch_candidates(session, candidates)
+
+        self._reply(session, replies, f'Based on the symptoms you are experiencing, you may be experiencing {row[0]}. Symptoms of {row[0]} include: {row[2]}. Is the diagnosis correct?\n\n(Type **Yes** if correct, **No** if wrong, **Stop** if you want to be re-diagnosed, **Summarize** if you want to get the summary of this chat.)')
+        session.state = IS_ASKING
+        session.possible_diseases = candidates
+
+    def _on_not_asking(self, session, prompt, replies):
+        if prompt in ['help', 'Help']:
+            self._reply(session, replies, HELP_MESSAGE)
+
+        elif prompt in ['summarize', 'Summarize']:
+            self._summarize(session, replies)
+
+        else:
+            disease, disease_similarity_score = self.get_most_similar_response(self.get_diseases_df(), 'Disease', prompt)
+
+            if disease_similarity_score >= 50:
+                self._propose(session, disease, replies)
+                return
+
+            with span('retrieval'):
+                responses = get_symptom_retriever(self.get_diseases_df()).query(prompt, top_k=3)
+
+            if len(responses) == 0 and self.llm_fallback:
+                responses = self.llm.get_most_similar_diseases(prompt)
+
+            if len(responses) == 0:
+                self._reply(session, replies, NO_MATCH_MESSAGE)
+            else:
+                self._propose(session, responses, replies)
+
+    def _on_is_asking(self, session, prompt, replies):
+        if prompt in ['summarize', 'Summarize']:
+            self._reset(session)
+            self._summarize(session, replies)
+
+        elif prompt in ['stop', 'Stop']:
+            self._reset(session)
+            self._reply(session, replies, STOP_MESSAGE)
+
+        elif prompt in ['yes', 'Yes']:
+            row_index, row = session.possible_diseases[0]
+
+            recommendation = self.get_recommendation(session, row[0])
+            self._reset(session)
+
+            self._reply(session, replies, compose_message(f'Glad we got it correct! You are experiencing {row[0]}. {row[3]}.\n\nThe symptoms include, which more than one of these you are currently experiencing: {row[2]}. Our recommendation: ', recommendation))
+
+        else:
+            # The proposed disease was rejected, its recommendation is no longer needed
+            prefetched_disease, future = session.prefetched_recommendation
+            if future is not None:
+                future.cancel()
+
+            session.possible_diseases.pop(0)
+
+            if len(session.possible_diseases) == 0:
+                session.state = SCAN_FAILED
+                return
+
+            self._start_questioning(session)
+
+    def _start_questioning(self, session):
+        # The remaining candidates are told apart together, one most informative question at a time
+        diseases_df = self.get_diseases_df()
+        candidates = [diseases_df.index.get_loc(row_index) for row_index, row in session.possible_diseases]
+
+        session.state = ASKING_SYMPTOM
+        session.questioning = Questioning(get_incidence_matrix(diseases_df), candidates)
+        session.experiencing_symptoms = []
+
+        self.prefetch_leader(session)
+
+    def _on_scan_failed(self, session, prompt, replies):
+        self._reset(session)
+        self._reply(session, replies, SCAN_FAILED_MESSAGE)
+
+    def _on_asking_symptom(self, session, prompt, replies):
+        if session.questioning is None:
+            session.state = SCAN_FAILED
+            return
+
+        symptom = session.questioning.next_question()
+
+        if symptom is None:
+            session.state = WAITING_SYMPTOM_CALCULATION
+            return
+
+        description = self.get_symptom_description(session, symptom)
+
+        self._reply(session, replies, f'Are you experiencing: {symptom.capitalize()}? {description}.')
+        session.state = WAITING_SYMPTOM_ANSWER
+        session.current_symptom = symptom
+
+    def _on_waiting_symptom_answer(self, session, prompt, replies):
+        if prompt in ['stop', 'Stop']:
+            self._reset(session)
+            self._reply(session, replies, STOP_MESSAGE)
+            return
+
+        session.state = ASKING_SYMPTOM
+        experiencing = prompt in ['yes', 'Yes']
+
+        session.questioning.answer(session.current_symptom, experiencing)
+
+        if experiencing:
+            session.experiencing_symptoms.append(session.current_symptom)
+
+        self.prefetch_leader(session)
+
+    def _on_waiting_symptom_calculation(self, session, prompt, replies):
+        position = session.questioning.diagnosis()
+
+        if position is None:
+            session.state = SCAN_FAILED
+            return
+
+        row = self.get_diseases_df().iloc[position].to_numpy()
+
+        recommendation = self.get_recommendation(session, row[0])
+        self._reset(session)
+
+        self._reply(session, replies, compose_message(f'You might be experiencing {row[0]}. {row[3]}.\n\nThe symptoms include, which more than one of these you are currently experiencing: {row[2]}. Our recommendation: ', recommendation, '.\n\n(If you are not confident in our answer, please try again and we recommend listing out what you are experiencing.)'))
+
+    def prefetch_candidates(self, session, candidates):
+        if not self.prefetch:
+            return
+
+        # Start the recommendation of the proposed disease while the user reads the question
+        row_index, row = candidates[0]
+        future = prefetcher.submit(session.session_id, self.llm.get_disease_response, row[0])
+        session.prefetched_recommendation = [row[0], future]
+
+        # The questions about the other candidates are only needed after a "No"
+        diseases_df = self.get_diseases_df()
+        symptoms = get_incidence_matrix(diseases_df).symptoms_of([diseases_df.index.get_loc(row_index) for row_index, row in candidates[1:]])
+
+        if session.prefetched_symptoms is None and len(symptoms) > 0:
+            session.prefetched_symptoms = prefetcher.submit(session.session_id, self.get_symptom_descriptions, symptoms)
+
+    def prefetch_leader(self, session):
+        if not self.prefetch:
+            return
+
+        # Follow the candidate currently ahead, a recommendation for a candidate that fell behind is dropped
+        position, probability = session.questioning.leader()
+        disease_name = self.get_diseases_df().iloc[position, 0]
+        prefetched_disease, future = session.prefetched_recommendation
+
+        if prefetched_disease == disease_name:
+            return
+
+        if future is not None:
+            future.cancel()
+
+        future = prefetcher.submit(session.session_id, self.llm.get_disease_response, disease_name)
+        session.prefetched_recommendation = [disease_name, future]
+
+    def cancel_prefetch(self, session):
+        prefetcher.cancel(session.session_id)
+
+        session.prefetched_recommendation = [None, None]
+        session.prefetched_symptoms = None
+
+    def get_recommendation(self, session, disease_name):
+        prefetched_disease, future = session.prefetched_recommendation
+        session.prefetched_recommendation = [None, None]
+
+        if prefetched_disease == disease_name and future is not None and not future.cancelled():
+            try:
+                return future.result()
+            except Exception:
+                pass
+
+        # Nothing usable was prefetched, stream a fresh request instead
+        return self.llm.get_disease_response(disease_name, stream=True)
+
+    def get_symptom_description(self, session, symptom):
+        future = session.prefetched_symptoms
+
+        if future is not None and future.done() and not future.cancelled() and future.exception() is None and symptom in future.result():
+            return future.result()[symptom]
+
+        return self.get_symptom_descriptions([symptom])[symptom]
+
+
+def serve(engine, port=8765):
+    # POST /step with {"session_id": ..., "message": ...}, answers {"session_id": ..., "state": ..., "replies": [...]}
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/step':
+                self.send_error(404)
+                return
+
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+            with sessions_lock:
+                session = sessions.get(body.get('session_id'))
+
+                if session is None:
+                    session = engine.new_session(body.get('session_id'))
+                    sessions[session.session_id] = session
+
+            replies = [render_text(reply) for reply in engine.step(session, body.get('message', ''))]
+            response = json.dumps({'session_id': session.session_id, 'state': session.state, 'replies': replies}).encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    print(f'Serving the conversation engine on http://127.0.0.1:{port}/step')
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    # python -m core.conversation [serve [port]], OPENAI_API_KEY is needed for recommendations and summaries
+    engine = ConversationEngine()
+    engine.warm_up()
+
+    if sys.argv[1:2] == ['serve']:
+        serve(engine, int(sys.argv[2]) if len(sys.argv) > 2 else 8765)
+    else:
+        session = engine.new_session()
+
+        for line in sys.stdin:
+            for reply in engine.step(session, line.strip()):
+                print(f'SymptoScan: {render_text(reply)}\n')
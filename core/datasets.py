@@ -0,0 +1,119 @@
+import os
+import hashlib
+import weakref
+import threading
+import pandas as pd
+from io import BytesIO
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'datasets')
+
+# Columnar copies of the parsed datasets, keyed by the CSV's content hash
+COLUMNAR_DIR = os.path.join(os.path.dirname(DATASETS_DIR), '.cache', 'datasets')
+
+_lock = threading.Lock()
+_datasets = {}
+
+_derived_lock = threading.Lock()
+_derived = {}
+
+
+def _dataset_path(name):
+    return os.path.join(DATASETS_DIR, f'{name}.csv')
+
+
+def load_dataset(name):
+    path = _dataset_path(name)
+    stat = os.stat(path)
+
+    with _lock:
+        dataset = _datasets.get(name)
+
+        # Cheap check first, the file is only read again when it was touched
+        if dataset is not None and dataset['mtime'] == stat.st_mtime_ns and dataset['size'] == stat.st_size:
+            return dataset['df']
+
+        with open(path, 'rb') as file:
+            content = file.read()
+
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        # Touched but unchanged, keep handing out the same frame
+        if dataset is not None and dataset['hash'] == content_hash:
+            dataset['mtime'] = stat.st_mtime_ns
+            dataset['size'] = stat.st_size
+            return dataset['df']
+
+        df = _read_columnar(name, content_hash, content)
+
+        _datasets[name] = {
+            'df': df,
+            'hash': content_hash,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size
+        }
+
+        return df
+
+
+def _read_columnar(name, content_hash, content):
+    # The CSV is only parsed once per content, later loads and other processes memory-map the uncompressed Arrow copy
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+    except ImportError:
+        return pd.read_csv(BytesIO(content))
+
+    path = os.path.join(COLUMNAR_DIR, f'{name}-{content_hash[:16]}.arrow')
+
+    if os.path.exists(path):
+        try:
+            return feather.read_table(path, memory_map=True).to_pandas()
+        except (OSError, pa.ArrowInvalid):
+            pass
+
+    df = pd.read_csv(BytesIO(content))
+
+    try:
+        os.makedirs(COLUMNAR_DIR, exist_ok=True)
+        feather.write_feather(df, f'{path}.tmp', compression='uncompressed')
+        os.replace(f'{path}.tmp', path)
+
+        # Copies of older contents are never read again
+        for file_name in os.listdir(COLUMNAR_DIR):
+            if file_name.startswith(f'{name}-') and file_name.endswith('.arrow') and os.path.join(COLUMNAR_DIR, file_name) != path:
+                os.remove(os.path.join(COLUMNAR_DIR, file_name))
+    except OSError:
+        pass
+
+    return df
+
+
+def get_dataset_hash(name):
+    load_dataset(name)
+
+    return _datasets[name]['hash']
+
+
+def get_diseases_df():
+    return load_dataset('diseases')
+
+
+def get_symptoms_df():
+    return load_dataset('symptoms')
+
+
+def cache_for_dataframe(df, key, build):
+    # Indexes built from a frame are shared process-wide and dropped together with it, e.g. once the dataset is reloaded
+    cache_key = (id(df), key)
+
+    with _derived_lock:
+        entry = _derived.get(cache_key)
+
+        if entry is not None and entry[0]() is df:
+            return entry[1]
+
+        df_ref = weakref.ref(df, lambda _: _derived.pop(cache_key, None))
+        value = build()
+        _derived[cache_key] = (df_ref, value)
+
+        return value
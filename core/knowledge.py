@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import warnings
+import threading
+import numpy as np
+import scipy.sparse as sp
+from core.datasets import DATASETS_DIR, cache_for_dataframe, get_dataset_hash, get_diseases_df, get_symptoms_df
+from core.nlp import preprocess_query
+from core.questioning import IncidenceMatrix
+from core.retrieval import SymptomRetriever
+from core.similarity import ExactSimilarityIndex, get_similarity_index
+
+# Bumped whenever the layout or the meaning of a section changes, older artifacts are refused
+FORMAT_VERSION = 2
+MAGIC = b'SYMPTOSCANKB\0'
+ALIGNMENT = 64
+
+KNOWLEDGE_BASE_PATH = os.path.join(os.path.dirname(DATASETS_DIR), '.cache', f'knowledge-v{FORMAT_VERSION}.kb')
+
+# The exact similarity indexes stored in the artifact, by dataset and column
+INDEXES = {'diseases': 'Disease', 'symptoms': 'Symptom'}
+
+
+class KnowledgeBaseError(Exception):
+    pass
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _string_table(strings):
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.cumsum([0] + [len(string) for string in encoded], dtype=np.int64)
+
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _content_hash(sources):
+    return hashlib.sha256(json.dumps({'format_version': FORMAT_VERSION, 'sources': sources}, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _current_sources():
+    return {name: get_dataset_hash(name) for name in INDEXES}
+
+
+def _symptom_description(symptoms_df, symptom):
+    # Exact names first, anything else is looked up the same way the chatbot does at runtime
+    matches = symptoms_df.loc[symptoms_df['Symptom'].str.lower() == symptom.lower(), 'Description']
+
+    if len(matches) > 0:
+        return matches.iloc[0]
+
+    return get_similarity_index(symptoms_df, 'Symptom').query(preprocess_query(symptom))[0][0][1][1]
+
+
+def compile_knowledge_base(path=KNOWLEDGE_BASE_PATH):
+    diseases_df = get_diseases_df()
+    symptoms_df = get_symptoms_df()
+    arrays = {}
+
+    for name, df in [('diseases', diseases_df), ('symptoms', symptoms_df)]:
+        index = ExactSimilarityIndex(df, INDEXES[name])
+        matrix = index.document_vectors
+
+        arrays[f'{name}.terms.data'], arrays[f'{name}.terms.offsets'] = _string_table(index.vectorizer.get_feature_names_out().tolist())
+        arrays[f'{name}.idf'] = index.vectorizer.idf_
+        arrays[f'{name}.matrix.data'] = matrix.data.astype(np.float64)
+        arrays[f'{name}.matrix.indices'] = matrix.indices.astype(np.int32)
+        arrays[f'{name}.matrix.indptr'] = matrix.indptr.astype(np.int64)
+
+    retriever = SymptomRetriever(diseases_df)
+    arrays['retriever.terms.data'], arrays['retriever.terms.offsets'] = _string_table(list(retriever.terms))
+    arrays['retriever.indptr'] = retriever.indptr.astype(np.int64)
+    arrays['retriever.documents'] = retriever.documents
+    arrays['retriever.weights'] = retriever.weights
+
+    # The normalized symptoms asked about, which disease has which, and what each of them means
+    incidence_matrix = IncidenceMatrix(diseases_df)
+    arrays['symptoms.names.data'], arrays['symptoms.names.offsets'] = _string_table(incidence_matrix.symptoms)
+    arrays['symptoms.descriptions.data'], arrays['symptoms.descriptions.offsets'] = _string_table([_symptom_description(symptoms_df, symptom) for symptom in incidence_matrix.symptoms])
+    arrays['incidence'] = incidence_matrix.incidence
+
+    sources = _current_sources()
+    header = {
+        'format_version': FORMAT_VERSION,
+        'sources': sources,
+        'content_hash': _content_hash(sources),
+        'shapes': {'diseases': [len(diseases_df), len(arrays['diseases.idf'])], 'symptoms': [len(symptoms_df), len(arrays['symptoms.idf'])]},
+        'sections': {}
+    }
+
+    offset = 0
+    payload_hash = hashlib.sha256()
+
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        offset = _align(offset)
+        header['sections'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset += array.nbytes
+        payload_hash.update(array.tobytes())
+
+    header['payload_sha256'] = payload_hash.hexdigest()
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    # Written aside and swapped in, processes that mapped the old file keep reading it
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.tmp'
+
+    with open(temporary_path, 'wb') as file:
+        file.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+
+        for name, array in arrays.items():
+            file.seek(data_start + header['sections'][name]['offset'])
+            file.write(array.tobytes())
+
+    os.replace(temporary_path, path)
+
+    return header
+
+
+class KnowledgeBase:
+    def __init__(self, path=KNOWLEDGE_BASE_PATH):
+        self.path = path
+        self.mtime = os.stat(path).st_mtime_ns
+        self._symptom_descriptions = None
+
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise KnowledgeBaseError(f'{path} is not a SymptoScan knowledge base')
+
+        header_length, = struct.unpack_from('<Q', self._mmap, len(MAGIC))
+        self.header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + header_length])
+        self.data_start = _align(len(MAGIC) + 8 + header_length)
+
+        if self.header.get('format_version') != FORMAT_VERSION:
+            raise KnowledgeBaseError(f'{path} has format version {self.header.get("format_version")}, expected {FORMAT_VERSION}, rebuild it')
+
+        if self.header['content_hash'] != _content_hash(self.header['sources']):
+            raise KnowledgeBaseError(f'{path} has an inconsistent header, rebuild it')
+
+    def array(self, name):
+        # A read-only view onto the mapped file, pages are shared by every process mapping it
+        section = self.header['sections'][name]
+        dtype = np.dtype(section['dtype'])
+        count = int(np.prod(section['shape'], dtype=np.int64))
+
+        return np.frombuffer(self._mmap, dtype=dtype, count=count, offset=self.data_start + section['offset']).reshape(section['shape'])
+
+    def strings(self, name):
+        data = self.array(f'{name}.data').tobytes()
+        offsets = self.array(f'{name}.offsets')
+
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def is_current(self):
+        return self.header['sources'] == _current_sources()
+
+    def verify(self):
+        payload_hash = hashlib.sha256()
+
+        for name in self.header['sections']:
+            payload_hash.update(self.array(name).tobytes())
+
+        return payload_hash.hexdigest() == self.header['payload_sha256']
+
+    def similarity_index(self, df, name):
+        rows, terms = self.header['shapes'][name]
+        matrix = sp.csr_matrix((self.array(f'{name}.matrix.data'), self.array(f'{name}.matrix.indices'), self.array(f'{name}.matrix.indptr')), shape=(terms, rows), copy=False)
+
+        return ExactSimilarityIndex.from_arrays(df, INDEXES[name], self.strings(f'{name}.terms'), self.array(f'{name}.idf'), matrix)
+
+    def symptom_retriever(self, df):
+        return SymptomRetriever.from_arrays(df, self.strings('retriever.terms'), self.array('retriever.indptr'), self.array('retriever.documents'), self.array('retriever.weights'))
+
+    def incidence_matrix(self):
+        return IncidenceMatrix.from_arrays(self.strings('symptoms.names'), self.array('incidence'))
+
+    def symptom_descriptions(self):
+        if self._symptom_descriptions is None:
+            self._symptom_descriptions = dict(zip(self.strings('symptoms.names'), self.strings('symptoms.descriptions')))
+
+        return self._symptom_descriptions
+
+    def install(self, diseases_df, symptoms_df):
+        # Seeds the process-wide caches, so the indexes of these frames are never fitted in-process
+        cache_for_dataframe(diseases_df, ('similarity', 'Disease', 'exact'), lambda: self.similarity_index(diseases_df, 'diseases'))
+        cache_for_dataframe(symptoms_df, ('similarity', 'Symptom', 'exact'), lambda: self.similarity_index(symptoms_df, 'symptoms'))
+        cache_for_dataframe(diseases_df, 'symptom_retriever', lambda: self.symptom_retriever(diseases_df))
+        cache_for_dataframe(diseases_df, 'incidence_matrix', self.incidence_matrix)
+
+
+_lock = threading.Lock()
+_knowledge_base = None
+_warned = set()
+
+
+def _warn(message):
+    if message not in _warned:
+        _warned.add(message)
+        warnings.warn(message)
+
+
+def get_knowledge_base(path=KNOWLEDGE_BASE_PATH):
+    # None without a usable artifact, the app then builds everything from the CSV files as before
+    global _knowledge_base
+
+    with _lock:
+        if not os.path.exists(path):
+            return None
+
+        if _knowledge_base is None or _knowledge_base.path != path or _knowledge_base.mtime != os.stat(path).st_mtime_ns:
+            try:
+                _knowledge_base = KnowledgeBase(path)
+            except (KnowledgeBaseError, ValueError, KeyError, struct.error) as error:
+                _knowledge_base = None
+                _warn(f'Ignoring the knowledge base: {error}')
+                return None
+
+        if not _knowledge_base.is_current():
+            _warn(f'Ignoring the stale knowledge base {path}, the datasets changed since it was built. Rebuild it: python -m core.knowledge build')
+            return None
+
+        return _knowledge_base
+
+
+def install_knowledge_base(path=KNOWLEDGE_BASE_PATH):
+    knowledge_base = get_knowledge_base(path)
+
+    if knowledge_base is not None:
+        knowledge_base.install(get_diseases_df(), get_symptoms_df())
+
+    return knowledge_base
+
+
+if __name__ == "__main__":
+    # python -m core.knowledge build|check [path], check exits with 1 on a missing, stale or corrupted artifact
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    path = sys.argv[2] if len(sys.argv) > 2 else KNOWLEDGE_BASE_PATH
+
+    if command == 'build':
+        header = compile_knowledge_base(path)
+        print(f'Built {path} ({os.path.getsize(path)} bytes, content hash {header["content_hash"][:12]})')
+
+    elif command == 'check':
+        try:
+            knowledge_base = KnowledgeBase(path)
+        except (OSError, KnowledgeBaseError, ValueError, KeyError, struct.error) as error:
+            print(error)
+            sys.exit(1)
+
+        if not knowledge_base.is_current():
+            print(f'{path} is stale, the datasets changed since it was built')
+            sys.exit(1)
+
+        if not knowledge_base.verify():
+            print(f'{path} is corrupted, its payload does not match the checksum')
+            sys.exit(1)
+
+        print(f'{path} is up to date')
+
+    else:
+        print('Usage: python -m core.knowledge [build|check] [path]')
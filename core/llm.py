@@ -0,0 +1,190 @@
+import sys
+import pandas as pd
+from io import StringIO
+from core.cache import ResponseCache
+from core.client import LLMUnavailable, ResilientClient
+from core.datasets import get_diseases_df
+from core.metrics import metrics, record_openai_call, span
+
+MODEL = 'gpt-3.5-turbo'
+
+response_cache = ResponseCache()
+
+# Shared by every session of the process, it caps the concurrent OpenAI calls and holds the circuit breaker
+client = ResilientClient()
+
+
+def _cached(model, prompt, stage):
+    result = response_cache.get(model, prompt, client.get_base_url())
+    metrics.increment('symptoscan_response_cache_total', (('stage', stage), ('result', 'miss' if result is None else 'hit')))
+
+    return result
+
+
+def create_completion(prompt, model=MODEL, use_cache=True, stage='completion'):
+    if use_cache:
+        result = _cached(model, prompt, stage)
+
+        if result is not None:
+            return result
+
+    with span(f'openai_{stage}'):
+        completion = client.create(
+            model=model,
+            messages=[
+                {'role': 'system', 'content': prompt}
+            ]
+        )
+
+    record_openai_call(stage, completion.usage.total_tokens if completion.usage else 0)
+
+    result = completion.choices[0].message.content
+
+    if use_cache:
+        response_cache.set(model, prompt, result, client.get_base_url())
+
+    return result
+
+
+def stream_completion(prompt, model=MODEL, use_cache=True, stage='completion'):
+    if use_cache:
+        result = _cached(model, prompt, stage)
+
+        if result is not None:
+            yield result
+            return
+
+    chunks = []
+    tokens = 0
+
+    # The span covers the whole stream, including the time the caller spends rendering each chunk
+    with span(f'openai_{stage}'):
+        stream = client.stream(
+            model=model,
+            messages=[
+                {'role': 'system', 'content': prompt}
+            ],
+            stream_options={'include_usage': True}
+        )
+
+        for chunk in stream:
+            if chunk.usage:
+                tokens = chunk.usage.total_tokens
+
+            if chunk.choices and chunk.choices[0].delta.content:
+                chunks.append(chunk.choices[0].delta.content)
+                yield chunks[-1]
+
+    record_openai_call(stage, tokens)
+
+    # Only a completed stream is cached
+    if use_cache:
+        response_cache.set(model, prompt, ''.join(chunks), client.get_base_url())
+
+
+def get_most_similar_diseases(prompt):
+    # Only reached through the optional LLM fallback of the local retriever
+    diseases_text = get_diseases_df().to_csv(index=False, sep=',')
+
+    prompt = f'I want you to act like a system that produces ONLY THE RESULT, NO PLACEHOLDERS, NOTHING MORE NOTHING LESS. I have this CSV:\n{diseases_text}\nWhat are the closest top 3 diseases based on this prompt, and get as CSV with intact headers and get the index of the results from the given CSV and add it onto a column before "Disease" and the name of the column is "row_index": {prompt}\nIf no similar data is found, simply return FALSE instead. And double check the CSV format, please fix it before sending.'
+    try:
+        result = create_completion(prompt, stage='most_similar_diseases')
+    except LLMUnavailable:
+        return []
+
+    if result.strip() == 'FALSE':
+        return []
+
+    # GPT does not always return valid CSV, treat that the same as no match
+    try:
+        result_df = pd.read_csv(StringIO(result))
+    except (ValueError, pd.errors.ParserError):
+        return []
+
+    if 'row_index' not in result_df.columns:
+        return []
+
+    diseases_df = get_diseases_df()
+
+    responses = []
+    for row_index in result_df['row_index']:
+        if row_index in diseases_df.index:
+            responses.append([row_index, diseases_df.loc[row_index].to_numpy()])
+
+    return responses
+
+
+def disease_response_prompt(disease_name):
+    return f'I want you to act like a system that produces ONLY THE RESULT, NO PLACEHOLDERS, NOTHING MORE NOTHING LESS. What is a better response if a patient has {disease_name}? Please expand the response in a way where the patient can be relieved and follow.'
+
+
+def get_disease_response(disease_name, stream=False):
+    prompt = disease_response_prompt(disease_name)
+
+    if stream:
+        return _with_fallback(stream_completion(prompt, stage='disease_response'), disease_name)
+
+    try:
+        return create_completion(prompt, stage='disease_response')
+    except LLMUnavailable:
+        return fallback_response(disease_name)
+
+
+def fallback_response(disease_name):
+    # The dataset's own response, used while OpenAI is failing or the circuit breaker is open
+    metrics.increment('symptoscan_openai_fallbacks_total')
+
+    diseases_df = get_diseases_df()
+    responses = diseases_df.loc[diseases_df['Disease'] == disease_name, 'Response']
+
+    return responses.iloc[0] if len(responses) > 0 else 'Please consult a doctor about your symptoms'
+
+
+def _with_fallback(chunks, disease_name):
+    # A stream that fails before its first chunk is answered from the dataset, a broken-off one just ends
+    started = False
+
+    try:
+        for chunk in chunks:
+            started = True
+            yield chunk
+    except LLMUnavailable:
+        if not started:
+            yield fallback_response(disease_name)
+
+
+def update_chat_summary(summary, messages):
+    # The previous summary and the new messages are both capped, so the prompt size does not grow with the chat
+    messages = "\n----SEPERATE MESSAGE----\n".join(f"{'User' if role == 'user' else 'SymptoScan'}: {text}" for role, text in messages)
+
+    prompt = f'I want you to act like a system that produces ONLY THE RESULT, NO PLACEHOLDERS, NOTHING MORE NOTHING LESS. Analyze and summarize the chat threads between the user and chatbot to gain insights about the user. Update the current summary with the new messages and keep it under 200 words.\n\nThe current summary:\n{summary or "None yet."}\n\nThe new messages:\n{messages}'
+
+    return create_completion(prompt, use_cache=False, stage='summarize')
+
+
+def warm_up():
+    # Precompute the recommendation of every disease so confirmed diagnoses skip the network, without the dataset fallback
+    failed = []
+
+    for disease_name in get_diseases_df()['Disease']:
+        try:
+            create_completion(disease_response_prompt(disease_name), stage='disease_response')
+            print(f'Cached: {disease_name}')
+        except LLMUnavailable as error:
+            failed.append(disease_name)
+            print(f'Failed: {disease_name} ({error})')
+
+    print(response_cache.stats())
+
+    return failed
+
+
+if __name__ == "__main__":
+    # OPENAI_API_KEY must be set: python -m core.llm warm
+    if sys.argv[1:] == ['warm']:
+        if len(warm_up()) > 0:
+            sys.exit(1)
+    elif sys.argv[1:] == ['stats']:
+        print(response_cache.stats())
+    else:
+        print('Usage: python -m core.llm [warm|stats]')
@@ -0,0 +1,83 @@
+import threading
+from collections import deque
+
+# Roughly 4 characters per token, every message and the summary are capped so the update prompt stays constant
+MAX_MESSAGE_CHARS = 800
+MAX_SUMMARY_CHARS = 1600
+MAX_PENDING_TURNS = 30
+
+
+def truncate(text, max_chars):
+    return text if len(text) <= max_chars else text[:max_chars - 1] + '…'
+
+
+class ConversationMemory:
+    __slots__ = ('pending', 'summary', 'bot_messages', 'generation', 'folding', 'updated', '_lock')
+
+    def __init__(self):
+        # Oldest messages fall off first, unlike the old trimming which dropped the newest one
+        self.pending = deque(maxlen=MAX_PENDING_TURNS)
+        self.summary = ''
+        self.bot_messages = 0
+        self.generation = 0
+        self.folding = 0
+        # Cleared while a background update runs, set once its result is in the summary or dropped
+        self.updated = threading.Event()
+        self.updated.set()
+        self._lock = threading.Lock()
+
+    def add(self, role, text):
+        message = (role, truncate(text, MAX_MESSAGE_CHARS))
+
+        with self._lock:
+            self.pending.append(message)
+
+            if role != 'user':
+                self.bot_messages += 1
+
+    def is_updating(self):
+        return not self.updated.is_set()
+
+    def wait_for_update(self):
+        self.updated.wait()
+
+    def unfolded(self):
+        # Pending messages the running background update does not cover
+        with self._lock:
+            return len(self.pending) - self.folding
+
+    def begin_update(self):
+        # Snapshot of what the next summary has to fold in, the pending messages stay until it succeeds
+        with self._lock:
+            self.generation += 1
+
+            return self.generation, self.summary, list(self.pending)
+
+    def finish_update(self, generation, folded, summary):
+        with self._lock:
+            # A later update started from the same messages and more, this one would pop messages it never saw
+            if generation != self.generation:
+                return
+
+            self.summary = truncate(summary.strip(), MAX_SUMMARY_CHARS)
+
+            for _ in range(min(len(folded), len(self.pending))):
+                self.pending.popleft()
+
+    def begin_background_update(self):
+        self.updated.clear()
+        generation, summary, folded = self.begin_update()
+        self.folding = len(folded)
+
+        return generation, summary, folded
+
+    def end_background_update(self, generation, folded, future):
+        # A cancelled or failed update leaves its messages pending for the next one
+        try:
+            if future is not None and not future.cancelled() and future.exception() is None:
+                self.finish_update(generation, folded, future.result())
+        finally:
+            with self._lock:
+                self.folding = 0
+
+            self.updated.set()
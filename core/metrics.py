@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+import contextvars
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_turn = contextvars.ContextVar('current_turn', default=None)
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bucket in enumerate(BUCKETS):
+            if value <= bucket:
+                self.counts[i] += 1
+                break
+
+        self.total += value
+        self.count += 1
+
+
+class Turn:
+    __slots__ = ('session_id', 'state', 'started_at', 'duration', 'spans', 'openai_calls', 'openai_tokens', 'reruns')
+
+    def __init__(self, session_id, state, reruns=0):
+        self.session_id = session_id
+        self.state = state
+        self.started_at = time.time()
+        self.duration = None
+        self.spans = []
+        self.openai_calls = 0
+        self.openai_tokens = 0
+        self.reruns = reruns
+
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'state': self.state,
+            'started_at': self.started_at,
+            'duration': self.duration,
+            'spans': [{'stage': stage, 'duration': duration} for stage, duration in self.spans],
+            'openai_calls': self.openai_calls,
+            'openai_tokens': self.openai_tokens,
+            'reruns': self.reruns
+        }
+
+
+class Metrics:
+    def __init__(self, recent_turns=100):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(Histogram)
+        self._counters = defaultdict(float)
+        self._recent_turns = deque(maxlen=recent_turns)
+        self._last_write = 0.0
+        self._write_lock = threading.Lock()
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            self._histograms[(name, labels)].observe(value)
+
+    def increment(self, name, labels=(), value=1):
+        with self._lock:
+            self._counters[(name, labels)] += value
+
+    def recent_turns(self, session_id=None):
+        with self._lock:
+            return [turn for turn in self._recent_turns if session_id is None or turn.session_id == session_id]
+
+    def finish_turn(self, turn):
+        labels = (('state', turn.state),)
+
+        with self._lock:
+            self._histograms[('symptoscan_turn_duration_seconds', labels)].observe(turn.duration)
+            self._counters[('symptoscan_turns_total', labels)] += 1
+            self._counters[('symptoscan_reruns_total', ())] += turn.reruns
+            self._recent_turns.append(turn)
+
+    def render_prometheus(self):
+        lines = []
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                lines.append(f'# TYPE {name} counter')
+                seen.add(name)
+
+            lines.append(f'{name}{_format_labels(labels)} {value:g}')
+
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                lines.append(f'# TYPE {name} histogram')
+                seen.add(name)
+
+            cumulative = 0
+            for bucket, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", f"{bucket:g}"),))} {cumulative}')
+
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram.count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram.total:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, min_interval=0):
+        # Sessions of the same process take turns, one that finds another already writing skips this time
+        if not self._write_lock.acquire(blocking=False):
+            return
+
+        try:
+            if time.time() - self._last_write < min_interval:
+                return
+
+            self._last_write = time.time()
+
+            # Written atomically so a node_exporter textfile collector never reads half a file, other processes use their own temporary file
+            temporary_path = f'{path}.{os.getpid()}.tmp'
+
+            with open(temporary_path, 'w') as file:
+                file.write(self.render_prometheus())
+
+            os.replace(temporary_path, path)
+        finally:
+            self._write_lock.release()
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ''
+
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def turn(session_id, state, reruns=0):
+    # Nested calls, e.g. the engine inside the page's turn, report into the outer turn
+    current = _current_turn.get()
+
+    if current is not None:
+        yield current
+        return
+
+    current = Turn(session_id, state, reruns)
+    token = _current_turn.set(current)
+    start = time.perf_counter()
+
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_turn.reset(token)
+        metrics.finish_turn(current)
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe('symptoscan_stage_duration_seconds', (('stage', stage),), duration)
+
+        current = _current_turn.get()
+        if current is not None:
+            current.spans.append((stage, duration))
+
+
+def record_openai_call(stage, tokens=0):
+    metrics.increment('symptoscan_openai_calls_total', (('stage', stage),))
+    metrics.increment('symptoscan_openai_tokens_total', (('stage', stage),), tokens)
+
+    current = _current_turn.get()
+    if current is not None:
+        current.openai_calls += 1
+        current.openai_tokens += tokens
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    # Serves GET /metrics in Prometheus text format, started at most once per process
+    global _server
+
+    with _server_lock:
+        if _server is not None:
+            return _server
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = metrics.render_prometheus().encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+
+        return _server
@@ -0,0 +1,74 @@
+import sys
+import time
+import threading
+import regex as re
+
+MODEL_NAME = "en_core_web_sm"
+
+# The query filter only reads is_stop, pos_ and text, pos_ comes from tagger + attribute_ruler
+EXCLUDED_COMPONENTS = ["parser", "ner", "lemmatizer", "senter"]
+
+REMOVE_POS = ["PRON", "PROPN", "AUX", "CCONJ", "NUM"]
+SPECIAL_CHARS_PATTERN = r'[^a-zA-z0-9\s(\)\[\]\{\}]'
+
+_lock = threading.Lock()
+_nlp = None
+
+
+def load_nlp(exclude=EXCLUDED_COMPONENTS):
+    # Imported here so pages that never see a free-text prompt skip spaCy entirely
+    import spacy
+
+    spacy.prefer_gpu()
+
+    return spacy.load(MODEL_NAME, exclude=exclude)
+
+
+def get_nlp():
+    global _nlp
+
+    # Loaded on the first free-text prompt, then shared by every session in the process
+    if _nlp is None:
+        with _lock:
+            if _nlp is None:
+                _nlp = load_nlp()
+
+    return _nlp
+
+
+def clean_query(query):
+    # Remove special characters
+    return re.sub(SPECIAL_CHARS_PATTERN, '', query.strip())
+
+
+def filter_doc(doc):
+    # Remove stop words and specific POS tags
+    return ' '.join([token.text for token in doc if not token.is_stop or token.pos_ not in REMOVE_POS])
+
+
+def preprocess_query(query):
+    return filter_doc(get_nlp()(clean_query(query)))
+
+
+def preprocess_queries(queries):
+    # nlp.pipe amortizes the pipeline overhead over a batch of queries
+    return [filter_doc(doc) for doc in get_nlp().pipe([clean_query(query) for query in queries])]
+
+
+if __name__ == "__main__":
+    # Compare the full pipeline with the trimmed one: python -m core.nlp [queries]
+    queries = sys.argv[1:] or ["I am experiencing symptoms such as runny nose, coughing, sore throat."]
+
+    for label, exclude in [("full", []), ("trimmed", EXCLUDED_COMPONENTS)]:
+        start = time.perf_counter()
+        nlp = load_nlp(exclude)
+        cold_start = time.perf_counter() - start
+
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for query in queries:
+                filter_doc(nlp(clean_query(query)))
+        per_query = (time.perf_counter() - start) / (rounds * len(queries))
+
+        print(f"{label}: pipes={nlp.pipe_names} cold_start={cold_start * 1000:.1f}ms per_query={per_query * 1000:.3f}ms")
@@ -0,0 +1,56 @@
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher:
+    def __init__(self, max_workers=4, max_pending=16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def submit(self, session_id, fn, *args):
+        # Speculative work is optional, skip it instead of queueing when the process is saturated
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        # In a copy of the caller's context, so OpenAI calls and spans count towards the turn that started them
+        future = self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+        with self._lock:
+            self._futures.setdefault(session_id, set()).add(future)
+
+        future.add_done_callback(lambda done: self._release(session_id, done))
+
+        return future
+
+    def _release(self, session_id, future):
+        self._slots.release()
+
+        with self._lock:
+            futures = self._futures.get(session_id)
+
+            if futures is not None:
+                futures.discard(future)
+
+                if not futures:
+                    del self._futures[session_id]
+
+    def cancel(self, session_id):
+        # Requests that already started cannot be interrupted, their result is simply dropped
+        with self._lock:
+            futures = list(self._futures.get(session_id, ()))
+
+        for future in futures:
+            future.cancel()
+
+    def pending(self, session_id=None):
+        with self._lock:
+            if session_id is None:
+                return sum(len(futures) for futures in self._futures.values())
+
+            return len(self._futures.get(session_id, ()))
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,161 @@
+import math
+import numpy as np
+from core.datasets import cache_for_dataframe
+from core.retrieval import split_symptoms
+
+# Chance that a patient answers against the dataset, e.g. a symptom they have but did not notice
+ANSWER_NOISE = 0.1
+
+# Prior of "none of the candidates", it lets a single candidate be confirmed or ruled out too
+NONE_PRIOR = 0.25
+
+CONFIDENCE = 0.9
+MAX_QUESTIONS = 8
+
+# Like the previous flow, a diagnosis also needs "yes" to 60% of the disease's own symptoms, the posterior alone jumps after a single answer
+MIN_CONFIRMED = 0.6
+
+
+class IncidenceMatrix:
+    def __init__(self, df, noise=ANSWER_NOISE):
+        # Questions come from the Specific Symptoms, a disease has a symptom when either column lists it
+        self.symptoms = []
+        self.positions = {}
+
+        for text in df['Specific Symptoms']:
+            for symptom in str(text).split(','):
+                if symptom.strip() and symptom.strip().lower() not in self.positions:
+                    self.positions[symptom.strip().lower()] = len(self.symptoms)
+                    self.symptoms.append(symptom.strip())
+
+        self.incidence = np.zeros((len(df), len(self.symptoms)), dtype=bool)
+
+        for row, (general, specific) in enumerate(zip(df['General Symptoms'], df['Specific Symptoms'])):
+            for symptom in split_symptoms(general) + split_symptoms(specific):
+                if symptom in self.positions:
+                    self.incidence[row, self.positions[symptom]] = True
+
+        self.set_probabilities(noise)
+
+    @classmethod
+    def from_arrays(cls, symptoms, incidence, noise=ANSWER_NOISE):
+        matrix = cls.__new__(cls)
+        matrix.symptoms = list(symptoms)
+        matrix.positions = {symptom.lower(): i for i, symptom in enumerate(matrix.symptoms)}
+        matrix.incidence = incidence
+        matrix.set_probabilities(noise)
+
+        return matrix
+
+    def set_probabilities(self, noise):
+        # P(yes | disease, symptom), "none of them" answers yes at the symptom's base rate
+        self.p_yes = np.where(self.incidence, 1 - noise, noise)
+        self.p_yes_none = np.clip(self.incidence.mean(axis=0), noise, 0.5)
+
+    def symptoms_of(self, candidates):
+        return [self.symptoms[i] for i in np.flatnonzero(self.incidence[list(candidates)].any(axis=0))]
+
+
+def get_incidence_matrix(df):
+    return cache_for_dataframe(df, 'incidence_matrix', lambda: IncidenceMatrix(df))
+
+
+def entropy(probabilities):
+    probabilities = np.clip(probabilities, 1e-12, 1.0)
+
+    return -(probabilities * np.log2(probabilities)).sum(axis=-1)
+
+
+class Questioning:
+    __slots__ = ('matrix', 'candidates', 'p_yes', 'posterior', 'askable', 'answers', 'min_confirmed')
+
+    def __init__(self, matrix, candidates, none_prior=NONE_PRIOR, min_confirmed=MIN_CONFIRMED):
+        # candidates are row positions in the diseases dataframe, the last hypothesis is "none of them"
+        self.matrix = matrix
+        self.candidates = list(candidates)
+        self.p_yes = np.vstack([matrix.p_yes[self.candidates], matrix.p_yes_none])
+        self.posterior = np.append(np.full(len(self.candidates), (1 - none_prior) / len(self.candidates)), none_prior)
+        # Only symptoms of at least one candidate are asked about, each of them once
+        self.askable = matrix.incidence[self.candidates].any(axis=0)
+        self.answers = []
+        self.min_confirmed = min_confirmed
+
+    def leader_index(self):
+        return int(np.argmax(self.posterior[:-1]))
+
+    def leader(self):
+        best = self.leader_index()
+
+        return self.candidates[best], self.posterior[best]
+
+    def is_confident(self, confidence=CONFIDENCE):
+        return self.posterior.max() >= confidence
+
+    def confirmations(self, best):
+        # "Yes" answers to symptoms of the candidate, and how many of them it takes
+        symptoms = self.matrix.incidence[self.candidates[best]]
+        confirmed = sum(1 for symptom, experiencing in self.answers if experiencing and symptoms[self.matrix.positions[symptom.lower()]])
+
+        return confirmed, math.ceil(self.min_confirmed * symptoms.sum() - 1e-9)
+
+    def is_confirmed(self, best):
+        confirmed, required = self.confirmations(best)
+
+        return confirmed >= required
+
+    def information_gain(self):
+        # How much the answer to every symptom is expected to shrink the posterior's entropy
+        p_yes = self.posterior @ self.p_yes
+        joint_yes = self.posterior[:, None] * self.p_yes
+        joint_no = self.posterior[:, None] * (1 - self.p_yes)
+
+        expected_entropy = p_yes * entropy((joint_yes / np.maximum(p_yes, 1e-12)).T) + (1 - p_yes) * entropy((joint_no / np.maximum(1 - p_yes, 1e-12)).T)
+        information_gain = entropy(self.posterior) - expected_entropy
+        information_gain[~self.askable] = -np.inf
+
+        return information_gain
+
+    def next_question(self, confidence=CONFIDENCE, max_questions=MAX_QUESTIONS):
+        # None once a diagnosis is accepted or ruled out, the budget is spent or no answer would tell the hypotheses apart
+        if len(self.answers) >= max_questions or self.posterior[-1] >= confidence:
+            return None
+
+        best = self.leader_index()
+        information_gain = self.information_gain()
+
+        if self.posterior[best] >= confidence:
+            if self.is_confirmed(best):
+                return None
+
+            # Confidently ahead but not confirmed yet, only its own remaining symptoms are asked about
+            remaining = self.askable & self.matrix.incidence[self.candidates[best]]
+            confirmed, required = self.confirmations(best)
+
+            if confirmed + remaining.sum() < required:
+                return None
+
+            information_gain[~remaining] = -np.inf
+
+            return self.matrix.symptoms[int(np.argmax(information_gain))]
+
+        question = int(np.argmax(information_gain))
+
+        if information_gain[question] <= 1e-6:
+            return None
+
+        return self.matrix.symptoms[question]
+
+    def answer(self, symptom, experiencing):
+        position = self.matrix.positions[symptom.lower()]
+        likelihood = self.p_yes[:, position] if experiencing else 1 - self.p_yes[:, position]
+
+        self.posterior = self.posterior * likelihood
+        self.posterior /= self.posterior.sum()
+        self.askable[position] = False
+        self.answers.append((symptom, experiencing))
+
+    def diagnosis(self, confidence=CONFIDENCE):
+        # The leading candidate when it is confidently ahead and confirmed, otherwise None
+        best = self.leader_index()
+
+        return self.candidates[best] if self.posterior[best] >= confidence and self.is_confirmed(best) else None
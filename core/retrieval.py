@@ -0,0 +1,136 @@
+import math
+import numpy as np
+import regex as re
+from collections import defaultdict
+from core.datasets import cache_for_dataframe
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Specific symptoms describe a disease better than the general ones
+FIELD_WEIGHTS = {'General Symptoms': 1.0, 'Specific Symptoms': 2.0}
+
+# A whole symptom phrase, e.g. "sore throat", counts more than its separate words
+PHRASE_WEIGHT = 2.0
+
+# Function words are only kept inside symptom phrases, on their own they match any sentence, e.g. "pain in the neck" and "what is in the news"
+STOP_WORDS = frozenset([
+    'a', 'about', 'after', 'all', 'am', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'been', 'before', 'being', 'but', 'by',
+    'can', 'could', 'did', 'do', 'does', 'doing', 'for', 'from', 'had', 'has', 'have', 'having', 'he', 'her', 'him', 'his',
+    'how', 'i', 'if', 'in', 'into', 'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or', 'our', 'she', 'so', 'some', 'than',
+    'that', 'the', 'their', 'them', 'then', 'there', 'these', 'they', 'this', 'those', 'to', 'too', 'us', 'very', 'was',
+    'we', 'were', 'what', 'when', 'where', 'which', 'while', 'who', 'why', 'will', 'with', 'would', 'you', 'your'
+])
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def split_symptoms(text):
+    return [symptom.strip().lower() for symptom in str(text).split(',') if symptom.strip()]
+
+
+class SymptomRetriever:
+    def __init__(self, df, field_weights=FIELD_WEIGHTS, k1=1.2, b=0.75):
+        self.row_indeces = df.index.to_numpy()
+        self.rows = df.to_numpy()
+        self.max_phrase_length = 1
+
+        # Weighted term frequencies per disease, terms are words and whole symptom phrases
+        term_frequencies = []
+        for _, row in df.iterrows():
+            frequencies = defaultdict(float)
+
+            for field, weight in field_weights.items():
+                for symptom in split_symptoms(row[field]):
+                    tokens = tokenize(symptom)
+                    self.max_phrase_length = max(self.max_phrase_length, len(tokens))
+
+                    for token in tokens:
+                        if token not in STOP_WORDS:
+                            frequencies[token] += weight
+
+                    if len(tokens) > 1:
+                        frequencies[' '.join(tokens)] += weight * PHRASE_WEIGHT
+
+            term_frequencies.append(frequencies)
+
+        # BM25, the saturated and idf-weighted score of every posting is computed once
+        document_count = len(term_frequencies)
+        lengths = [sum(frequencies.values()) for frequencies in term_frequencies]
+        average_length = (sum(lengths) / document_count) if document_count > 0 else 0
+
+        document_frequencies = defaultdict(int)
+        for frequencies in term_frequencies:
+            for term in frequencies:
+                document_frequencies[term] += 1
+
+        postings = defaultdict(list)
+        for document, frequencies in enumerate(term_frequencies):
+            norm = k1 * (1 - b + b * lengths[document] / average_length)
+
+            for term, frequency in frequencies.items():
+                idf = math.log(1 + (document_count - document_frequencies[term] + 0.5) / (document_frequencies[term] + 0.5))
+                postings[term].append((document, idf * frequency * (k1 + 1) / (frequency + norm)))
+
+        # Flattened into CSR arrays, one slice of documents and scores per term
+        terms = sorted(postings)
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.indptr = np.cumsum([0] + [len(postings[term]) for term in terms])
+        self.documents = np.array([document for term in terms for document, _ in postings[term]], dtype=np.int32)
+        self.weights = np.array([score for term in terms for _, score in postings[term]], dtype=np.float64)
+
+    @classmethod
+    def from_arrays(cls, df, terms, indptr, documents, weights):
+        # Precomputed postings, e.g. memory-mapped from the knowledge base
+        retriever = cls.__new__(cls)
+        retriever.row_indeces = df.index.to_numpy()
+        retriever.rows = df.to_numpy()
+        retriever.terms = {term: i for i, term in enumerate(terms)}
+        retriever.max_phrase_length = max((term.count(' ') + 1 for term in terms), default=1)
+        retriever.indptr = indptr
+        retriever.documents = documents
+        retriever.weights = weights
+
+        return retriever
+
+    def query_terms(self, query):
+        tokens = tokenize(query)
+        terms = set()
+
+        terms.update(token for token in tokens if token not in STOP_WORDS)
+
+        for length in range(2, self.max_phrase_length + 1):
+            for i in range(len(tokens) - length + 1):
+                terms.add(' '.join(tokens[i:i + length]))
+
+        return terms
+
+    def scores(self, query):
+        # Returns the matched documents and their summed scores
+        rows = [self.terms[term] for term in self.query_terms(query) if term in self.terms]
+
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+
+        documents = np.concatenate([self.documents[self.indptr[row]:self.indptr[row + 1]] for row in rows])
+        weights = np.concatenate([self.weights[self.indptr[row]:self.indptr[row + 1]] for row in rows])
+        documents, inverse = np.unique(documents, return_inverse=True)
+
+        return documents, np.bincount(inverse, weights=weights)
+
+    def search(self, query, top_k=3):
+        # Returns the positions of the Top k rows and their scores, rows sharing no term with the query are left out
+        documents, scores = self.scores(query)
+        ranked = np.lexsort((documents, -scores))[:top_k]
+
+        return documents[ranked], scores[ranked]
+
+    def query(self, query, top_k=3):
+        documents, scores = self.search(query, top_k)
+
+        return [[self.row_indeces[document].item(), self.rows[document]] for document in documents]
+
+
+def get_symptom_retriever(df):
+    return cache_for_dataframe(df, 'symptom_retriever', lambda: SymptomRetriever(df))
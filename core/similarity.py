@@ -0,0 +1,187 @@
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from core.datasets import cache_for_dataframe
+
+def top_k_indeces(scores, top_k):
+    # argpartition keeps the selection linear, only the k winners are sorted, ties by dataset order
+    if top_k < len(scores):
+        indeces = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        indeces = np.arange(len(scores))
+
+    return indeces[np.lexsort((indeces, -scores[indeces]))]
+
+
+class SimilarityIndex:
+    def __init__(self, df, column):
+        self.column = column
+        self.row_indeces = df.index.to_numpy()
+        self.rows = df.to_numpy()
+
+        # Fit TF-IDF once, the rows are L2-normalized so a dot product is the cosine similarity
+        self.vectorizer = TfidfVectorizer(use_idf=True, max_df=0.5, min_df=1, ngram_range=(1, 3))
+        self.document_vectors = self.vectorizer.fit_transform(df[column].astype(str)).tocsr()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def scores(self, query):
+        query_vector = self.vectorizer.transform([query])
+
+        return (self.document_vectors @ query_vector.T).toarray().ravel()
+
+    def search(self, query, top_k=1):
+        # Returns the positions of the Top k rows and their similarity scores
+        similarity_scores = self.scores(query)
+        sorted_indeces = top_k_indeces(similarity_scores, top_k)
+
+        return sorted_indeces, similarity_scores[sorted_indeces]
+
+    def query(self, query, top_k=1):
+        sorted_indeces, similarity_scores = self.search(query, top_k)
+
+        return self.responses(sorted_indeces, similarity_scores)
+
+    def search_batch(self, queries, top_k=1):
+        return [self.search(query, top_k) for query in queries]
+
+    def query_batch(self, queries, top_k=1):
+        return [self.responses(sorted_indeces, similarity_scores) for sorted_indeces, similarity_scores in self.search_batch(queries, top_k)]
+
+    def responses(self, sorted_indeces, similarity_scores):
+        # Get the similarity score of the chosen response
+        similarity_score = similarity_scores[0] * 100
+
+        responses = [[self.row_indeces[i].item(), self.rows[i]] for i in sorted_indeces]
+
+        return responses, similarity_score
+
+
+class ExactSimilarityIndex(SimilarityIndex):
+    def __init__(self, df, column):
+        super().__init__(df, column)
+
+        # Keep it transposed so scoring a query is a single sparse dot product over the query's terms
+        self.document_vectors = self.document_vectors.T.tocsr()
+
+    @classmethod
+    def from_arrays(cls, df, column, terms, idf, document_vectors):
+        # A fitted index without fitting, e.g. memory-mapped from the knowledge base, document_vectors is terms x rows
+        index = cls.__new__(cls)
+        index.column = column
+        index.row_indeces = df.index.to_numpy()
+        index.rows = df.to_numpy()
+        index.vectorizer = TfidfVectorizer(use_idf=True, ngram_range=(1, 3), vocabulary={term: i for i, term in enumerate(terms)})
+        index.vectorizer.idf_ = idf
+        index.document_vectors = document_vectors
+
+        return index
+
+    def scores(self, query):
+        query_vector = self.vectorizer.transform([query])
+
+        return (query_vector @ self.document_vectors).toarray()[0]
+
+    def search_batch(self, queries, top_k=1):
+        # One sparse product scores the whole batch
+        batch_scores = (self.vectorizer.transform(queries) @ self.document_vectors).toarray()
+        results = []
+
+        for scores in batch_scores:
+            sorted_indeces = top_k_indeces(scores, top_k)
+            results.append((sorted_indeces, scores[sorted_indeces]))
+
+        return results
+
+
+class ApproximateSimilarityIndex(SimilarityIndex):
+    PRIME = (1 << 31) - 1
+
+    def __init__(self, df, column, bands=32, band_size=3, max_candidates=2000, chunk_size=1000, seed=0):
+        super().__init__(df, column)
+
+        self.bands = bands
+        self.band_size = band_size
+        self.max_candidates = max_candidates
+
+        # Shingles are hashed character n-grams, the signatures need no vocabulary of their own
+        self.shingler = HashingVectorizer(analyzer='char_wb', ngram_range=(3, 3), n_features=1 << 20, alternate_sign=False, norm=None, binary=True)
+
+        rng = np.random.default_rng(seed)
+        self.permutations_a = rng.integers(1, self.PRIME, bands * band_size, dtype=np.int64)
+        self.permutations_b = rng.integers(0, self.PRIME, bands * band_size, dtype=np.int64)
+        self.band_mix = rng.integers(1, 1 << 62, band_size, dtype=np.uint64)
+
+        texts = df[column].astype(str).tolist()
+        keys = np.concatenate([self.band_keys(texts[i:i + chunk_size]) for i in range(0, len(texts), chunk_size)]) if texts else np.empty((0, bands), dtype=np.uint64)
+
+        # One sorted key table per band, 12 bytes per row and band on top of the TF-IDF matrix the candidates are rescored with
+        self.band_order = []
+        self.band_sorted_keys = []
+
+        for band in range(bands):
+            order = np.argsort(keys[:, band], kind='stable')
+            self.band_order.append(order.astype(np.int32))
+            self.band_sorted_keys.append(keys[order, band])
+
+    def band_keys(self, texts):
+        shingles = self.shingler.transform(texts)
+        signatures = np.full((len(texts), len(self.permutations_a)), self.PRIME, dtype=np.int64)
+
+        # MinHash: the smallest permuted shingle of every row, computed segment-wise over the CSR layout
+        non_empty = np.diff(shingles.indptr) > 0
+
+        if shingles.nnz > 0:
+            hashed = (shingles.indices.astype(np.int64)[:, None] * self.permutations_a + self.permutations_b) % self.PRIME
+            signatures[non_empty] = np.minimum.reduceat(hashed, shingles.indptr[:-1][non_empty], axis=0)
+
+        banded = signatures.reshape(len(texts), self.bands, self.band_size).astype(np.uint64)
+
+        return (banded * self.band_mix).sum(axis=2)
+
+    def candidates(self, query):
+        keys = self.band_keys([query])[0]
+        matches = []
+
+        for band in range(self.bands):
+            sorted_keys = self.band_sorted_keys[band]
+            start = np.searchsorted(sorted_keys, keys[band], side='left')
+            end = min(np.searchsorted(sorted_keys, keys[band], side='right'), start + self.max_candidates)
+            matches.append(self.band_order[band][start:end])
+
+        matches = np.concatenate(matches)
+
+        if len(matches) == 0:
+            return matches
+
+        # Rows colliding in more bands have a higher estimated Jaccard similarity
+        candidates, collisions = np.unique(matches, return_counts=True)
+
+        if len(candidates) > self.max_candidates:
+            candidates = candidates[np.argpartition(-collisions, self.max_candidates - 1)[:self.max_candidates]]
+
+        return np.sort(candidates)
+
+    def search(self, query, top_k=1):
+        candidates = self.candidates(query)
+
+        # No row shares enough shingles, e.g. a whole sentence against short names, fall back to scoring every row
+        if len(candidates) == 0:
+            return super().search(query, top_k)
+
+        query_vector = self.vectorizer.transform([query])
+        similarity_scores = (self.document_vectors[candidates] @ query_vector.T).toarray().ravel()
+        sorted_indeces = top_k_indeces(similarity_scores, top_k)
+
+        return candidates[sorted_indeces], similarity_scores[sorted_indeces]
+
+
+# Approximate matching is opt-in, it only beats the exact index on latency from about a million rows
+INDEX_BACKENDS = {
+    'exact': ExactSimilarityIndex,
+    'approximate': ApproximateSimilarityIndex
+}
+
+
+def get_similarity_index(df, column, backend='exact'):
+    return cache_for_dataframe(df, ('similarity', column, backend), lambda: INDEX_BACKENDS[backend](df, column))
@@ -0,0 +1,188 @@
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from core.datasets import load_dataset
+from core.metrics import metrics
+from core.nlp import get_nlp, preprocess_queries
+from core.similarity import get_similarity_index
+
+BACKENDS = ['inline', 'thread', 'process']
+
+# Queries waiting to be batched, once it is full new ones are turned away instead of queueing up
+MAX_QUEUE = 64
+MAX_BATCH = 16
+MAX_WAIT = 0.005
+MATCH_TIMEOUT = 10.0
+
+
+class Overloaded(Exception):
+    pass
+
+
+def match_batch(dataset, column, queries, top_k):
+    # Runs on a worker, the datasets and indexes are resolved there, so only the queries and the results travel
+    df = load_dataset(dataset)
+
+    return get_similarity_index(df, column).query_batch(preprocess_queries(queries), top_k)
+
+
+def _init_process():
+    # Each worker process loads spaCy once and maps the knowledge base when one was built
+    from core.knowledge import install_knowledge_base
+
+    install_knowledge_base()
+    get_nlp()
+
+
+class MatchingPool:
+    def __init__(self, backend='thread', workers=2, max_queue=MAX_QUEUE, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.backend = backend
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        # At most two batches per worker are handed over, the rest wait in the bounded queue
+        self._in_flight = threading.BoundedSemaphore(workers * 2)
+        self._batches_in_flight = 0
+        self._counter_lock = threading.Lock()
+
+        self._executor = self._new_executor()
+        self._restart_lock = threading.Lock()
+
+        threading.Thread(target=self._dispatch, name='matching-dispatcher', daemon=True).start()
+
+    def _new_executor(self):
+        if self.backend == 'process':
+            # Spawned, forking a process that already runs threads is not safe
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_process)
+
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='matching')
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, dataset, column, query, top_k=1):
+        future = Future()
+
+        try:
+            self._queue.put_nowait((dataset, column, query, top_k, future, time.perf_counter()))
+        except queue.Full:
+            metrics.increment('symptoscan_matching_rejected_total')
+            raise Overloaded('The matching queue is full')
+
+        return future
+
+    def match(self, dataset, column, query, top_k=1, timeout=MATCH_TIMEOUT):
+        return self.match_many(dataset, column, [query], top_k, timeout)[0]
+
+    def match_many(self, dataset, column, queries, top_k=1, timeout=MATCH_TIMEOUT):
+        futures = [self.submit(dataset, column, query, top_k) for query in queries]
+        deadline = time.monotonic() + timeout
+
+        try:
+            return [future.result(max(0, deadline - time.monotonic())) for future in futures]
+        except TimeoutError:
+            metrics.increment('symptoscan_matching_timeouts_total')
+            raise Overloaded('The matching workers did not answer in time')
+
+    def _collect(self):
+        # Micro-batching: whatever is already queued goes along, and while the workers are busy the batch waits up to max_wait for more
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            try:
+                if self._batches_in_flight > 0:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _dispatch(self):
+        while True:
+            groups = {}
+
+            for request in self._collect():
+                dataset, column, query, top_k, future, submitted_at = request
+                groups.setdefault((dataset, column, top_k), []).append(request)
+
+            for (dataset, column, top_k), requests in groups.items():
+                self._in_flight.acquire()
+
+                with self._counter_lock:
+                    self._batches_in_flight += 1
+
+                metrics.increment('symptoscan_matching_batches_total')
+                metrics.increment('symptoscan_matching_queries_total', value=len(requests))
+
+                executor = self._executor
+
+                try:
+                    done = executor.submit(match_batch, dataset, column, [request[2] for request in requests], top_k)
+                except BrokenExecutor:
+                    self._release()
+                    self._restart(executor, requests)
+                    continue
+
+                done.add_done_callback(lambda done, executor=executor, requests=requests: self._resolve(done, executor, requests))
+
+    def _release(self):
+        with self._counter_lock:
+            self._batches_in_flight -= 1
+
+        self._in_flight.release()
+
+    def _resolve(self, done, executor, requests):
+        self._release()
+
+        if isinstance(done.exception(), BrokenExecutor):
+            self._restart(executor, requests)
+            return
+
+        if done.exception() is not None:
+            self._fail(requests, done.exception())
+            return
+
+        now = time.perf_counter()
+
+        for (dataset, column, query, top_k, future, submitted_at), result in zip(requests, done.result()):
+            metrics.observe('symptoscan_matching_seconds', (), now - submitted_at)
+            future.set_result(result)
+
+    def _restart(self, executor, requests):
+        # A worker process died, its batch is answered as an overload and the next batches get fresh workers
+        with self._restart_lock:
+            if self._executor is executor:
+                metrics.increment('symptoscan_matching_restarts_total')
+                self._executor = self._new_executor()
+
+        self._fail(requests, Overloaded('A matching worker stopped'))
+
+    def _fail(self, requests, error):
+        for dataset, column, query, top_k, future, submitted_at in requests:
+            future.set_exception(error)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_matching_pool(backend='thread', workers=2):
+    # One pool per backend and process, None keeps the matching inline
+    if backend == 'inline':
+        return None
+
+    with _pools_lock:
+        if backend not in _pools:
+            _pools[backend] = MatchingPool(backend, workers)
+
+        return _pools[backend]
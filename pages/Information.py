@@ -1,6 +1,8 @@
 import random
 import streamlit as st
-import pandas as pd
+from core.catalog import PAGE_SIZES, get_page, search_diseases, search_symptoms
+from core.datasets import get_diseases_df, get_symptoms_df
+from core.knowledge import install_knowledge_base
 
 st.set_page_config(
     page_title="Information",
@@ -25,8 +27,34 @@ random_quotes = [
 st.sidebar.success(random.choice(random_quotes))
 
 
-diseases_df = pd.read_csv("https://raw.githubusercontent.com/smgestupa/ccs311-cs41s1-streamlit-symptoscan/main/datasets/diseases.csv")
-symptoms_df = pd.read_csv("https://raw.githubusercontent.com/smgestupa/ccs311-cs41s1-streamlit-symptoscan/main/datasets/symptoms.csv")
+# Shared with the chatbot page, the datasets are loaded once per process and not per session
+diseases_df = get_diseases_df()
+symptoms_df = get_symptoms_df()
+
+# The searches use the chatbot's indexes, mapped from the knowledge base when one was built
+install_knowledge_base()
+
+
+def reset_page(key):
+    st.session_state[f'{key}_page'] = 1
+
+
+def render_table(df, key, search, placeholder):
+    query = st.text_input('Search', key=f'{key}_query', placeholder=placeholder, on_change=reset_page, args=(key,))
+    positions = search(df, query)
+
+    page_size = st.selectbox('Rows per page', PAGE_SIZES, key=f'{key}_page_size', on_change=reset_page, args=(key,))
+    page_count = max(1, -(-len(positions) // page_size))
+
+    # The dataset may have shrunk since the page was chosen
+    if st.session_state.get(f'{key}_page', 1) > page_count:
+        reset_page(key)
+
+    page = st.number_input('Page', min_value=1, max_value=page_count, key=f'{key}_page')
+    rows, start, _ = get_page(df, positions, page, page_size)
+
+    st.dataframe(data=rows)
+    st.caption(f'Showing {start + 1 if len(rows) > 0 else 0}–{start + len(rows)} of {len(positions)} rows, page {page} of {page_count}')
 
 
 "# 💊 Information"
@@ -44,11 +72,11 @@ with col1:
 
     "By articulating the symptoms you're currently facing, the chatbot employs its programmed algorithms to analyze the information and provide potential explanations or suggestions."
 
-    st.dataframe(data=diseases_df)
+    render_table(diseases_df, 'diseases', search_diseases, 'e.g. Common Cold, or runny nose, sore throat')
 
 with col2:
     "## Symptoms Dataset"
 
     "By informing the chatbot about various symptoms you may be experiencing, it can help identify potential illnesses."
 
-    st.dataframe(data=symptoms_df)
\ No newline at end of file
+    render_table(symptoms_df, 'symptoms', search_symptoms, 'e.g. runny nose')
\ No newline at end of file